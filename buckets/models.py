@@ -8,8 +8,34 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy, gettext as _
 from django.contrib.auth import get_user_model
 from django.db.models import F, Max
+from django.core.cache import cache
+from django.conf import settings
 
 from utils.md5 import EMPTY_HEX_MD5, get_str_hexMD5
+from utils.counters import get_incrementer
+
+
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)   # 进程内缓存，其他进程无法失效
+
+
+def get_bucket_cache_timeout():
+    """
+    存储桶缓存时长(秒)，未配置共享缓存(CACHES 'default'为进程内缓存)时不缓存
+
+    :return: int; 0不缓存
+    """
+    timeout = getattr(settings, 'S3_BUCKET_CACHE_TIMEOUT', 0)
+    if not timeout:
+        return 0
+
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend in LOCAL_CACHE_BACKENDS:
+        return 0
+
+    return timeout
 
 
 def rand_hex_string(length=10):
@@ -132,12 +158,65 @@ class Bucket(BucketBase):
         """
         return Bucket.objects.select_related('user').filter(name=bucket_name).first()
 
+    @staticmethod
+    def _bucket_cache_key(bucket_name):
+        return f's3:bucket:{bucket_name}'
+
+    @classmethod
+    def get_bucket_by_name_cached(cls, bucket_name):
+        """
+        获取存储通对象，先从缓存查找，缓存时长settings.S3_BUCKET_CACHE_TIMEOUT秒，为0或未配置共享缓存时不缓存
+
+        :param bucket_name: 存储通名称
+        :return: Bucket对象; None(不存在)
+        """
+        timeout = get_bucket_cache_timeout()
+        if not timeout:
+            return cls.get_bucket_by_name(bucket_name)
+
+        key = cls._bucket_cache_key(bucket_name)
+        try:
+            bucket = cache.get(key)
+        except Exception as e:
+            bucket = None
+
+        if bucket is not None:
+            return bucket
+
+        bucket = cls.get_bucket_by_name(bucket_name)
+        if bucket is not None:
+            try:
+                cache.set(key, bucket, timeout=timeout)
+            except Exception as e:
+                pass
+
+        return bucket
+
+    @classmethod
+    def clear_bucket_cache(cls, bucket_name):
+        """
+        删除存储桶缓存
+        """
+        if not get_bucket_cache_timeout():
+            return
+
+        try:
+            cache.delete(cls._bucket_cache_key(bucket_name))
+        except Exception as e:
+            pass
+
     def save(self, *args, **kwargs):
         if not self.ftp_password or len(self.ftp_password) < 6:
             self.ftp_password = rand_hex_string()
         if not self.ftp_ro_password or len(self.ftp_ro_password) < 6:
             self.ftp_ro_password = rand_hex_string()
         super().save(**kwargs)
+        self.clear_bucket_cache(self.name)      # 任何字段修改都使缓存失效
+
+    def delete(self, *args, **kwargs):
+        r = super().delete(*args, **kwargs)
+        self.clear_bucket_cache(self.name)
+        return r
 
     def delete_and_archive(self):
         """
@@ -191,7 +270,7 @@ class Bucket(BucketBase):
         if not self.collection_name:
             name = f'bucket_{self.id}'
             self.collection_name = name
-            self.save()
+            self.save(update_fields=['collection_name'])
 
         return self.collection_name
 
@@ -531,7 +610,8 @@ class BucketFileBase(models.Model):
         abstract = True
         app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
         ordering = ['fod', '-id']
-        indexes = [models.Index(fields=('na_md5',), name='na_md5_idx')]
+        indexes = [models.Index(fields=('na_md5',), name='na_md5_idx'),
+                   models.Index(fields=('fod', '-id'), name='fod_id_idx')]
         unique_together = ('did', 'name')
         verbose_name = '对象模型抽象基类'
         verbose_name_plural = verbose_name
@@ -717,10 +797,15 @@ class BucketFileBase(models.Model):
 
     def download_cound_increase(self):
         """
-        下载次数加1
+        下载次数加1；settings.S3_DOWNLOAD_COUNT_FLUSH_INTERVAL大于0时，由后台线程延迟批量写入数据库
 
         :return: True(success); False(error)
         """
+        interval = getattr(settings, 'S3_DOWNLOAD_COUNT_FLUSH_INTERVAL', 0)
+        if interval and interval > 0:
+            get_incrementer('dlc', interval=interval).increase(model=type(self), pk=self.pk)
+            return True
+
         self.dlc = F('dlc') + 1 # (self.dlc or 0) + 1  # 下载次数+1
         try:
             self.save(update_fields=['dlc'])
@@ -1,11 +1,38 @@
+import logging
+
 from django.apps import AppConfig
-from django.core.checks import register
+from django.conf import settings
+from django.core.checks import register, Tags
+from django.core.signals import request_started
 
 from . import checks
 
 
+logger = logging.getLogger('django.request')
+
+PRELOAD_DISPATCH_UID = 's3api.preload_parts_model_classes'
+
+
+def preload_parts_model_classes_on_first_request(sender, **kwargs):
+    """
+    每个进程收到第一个请求时预创建对象part模型类，只执行一次；
+    不在ready()中查询数据库，migrate等管理命令和空数据库时不受影响
+    """
+    request_started.disconnect(dispatch_uid=PRELOAD_DISPATCH_UID)
+    from .managers import preload_parts_model_classes
+
+    try:
+        preload_parts_model_classes()
+    except Exception as e:      # 如数据库表还不存在
+        logger.warning(f'preload parts model classes error, {str(e)}')
+
+
 class S3ApiConfig(AppConfig):
     name = 's3api'
 
     def ready(self):
         register(checks.check_ceph_settins)
+        register(checks.check_bucket_cache_settings)
+        register(checks.check_multipart_upload_key_md5, Tags.database)
+        if getattr(settings, 'S3_PRELOAD_PARTS_MODEL_CLASSES', False):
+            request_started.connect(preload_parts_model_classes_on_first_request, dispatch_uid=PRELOAD_DISPATCH_UID)
@@ -59,3 +59,38 @@ def check_ceph_settins(app_configs, **kwargs):
                   '请至少确保有一个CEPH集群配置“DISABLE_CHOICE”为False'))
 
     return errors
+
+
+def check_bucket_cache_settings(app_configs, **kwargs):
+    from buckets.models import LOCAL_CACHE_BACKENDS
+
+    errors = []
+    timeout = getattr(settings, 'S3_BUCKET_CACHE_TIMEOUT', 0)
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if timeout and backend in LOCAL_CACHE_BACKENDS:
+        errors.append(Error(f'配置了存储桶缓存“S3_BUCKET_CACHE_TIMEOUT”，但“CACHES”的default缓存“{backend}”是进程内缓存，'
+                            '桶修改或删除后其他进程的缓存不会失效，请配置共享缓存(如Redis)或设置“S3_BUCKET_CACHE_TIMEOUT”为0'))
+
+    return errors
+
+
+def check_multipart_upload_key_md5(app_configs, databases=None, **kwargs):
+    """
+    多部分上传表key_md5列必须已转为BINARY(16)，数据库检查，migrate或check --database时执行
+    """
+    if not databases:
+        return []
+
+    from .models import MultipartUpload
+    from .utils import get_model_column_type
+
+    try:
+        data_type = get_model_column_type(MultipartUpload, 'key_md5')
+    except Exception as e:
+        return [Warning(f'查询多部分上传表key_md5列类型错误，{str(e)}')]
+
+    if data_type is not None and data_type != 'binary':
+        return [Error(f'多部分上传表key_md5列类型为“{data_type}”，还未转换为binary，'
+                      '请先执行“manage.py create_multipart_upload_table --convert-key-md5”')]
+
+    return []
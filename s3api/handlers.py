@@ -1,4 +1,5 @@
 import time
+from collections import deque
 from urllib import parse
 
 from django.utils import timezone
@@ -16,11 +17,19 @@ from .harbor import HarborManager
 from . import renders
 from . import paginations
 from . import serializers
-from utils.oss.pyrados import build_harbor_object, build_harbor_object_part
+from utils.oss.pyrados import build_harbor_object, build_harbor_object_part, RadosError
 
 
 MULTIPART_UPLOAD_MAX_SIZE = getattr(settings, 'S3_MULTIPART_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)        # default 2GB
 MULTIPART_UPLOAD_MIN_SIZE = getattr(settings, 'S3_MULTIPART_UPLOAD_MIN_SIZE', 5 * 1024 ** 2)        # default 5MB
+COMPLETE_MULTIPART_BLOCK_SIZE = 4 * 1024 ** 2        # 组合part时每次读写的数据块长度
+COMPLETE_MULTIPART_MAX_IN_FLIGHT = 8        # 组合part时最多同时进行的异步读/写操作数
+PARTS_DELETE_MAX_IN_FLIGHT = 64     # 清理part rados数据时最多同时进行的异步删除part数
+_HM = HarborManager()   # 无状态，所有请求共用
+OBJECT_ACL_CHOICES = {
+    'private': BucketFileBase.SHARE_ACCESS_NO, 'public-read': BucketFileBase.SHARE_ACCESS_READONLY,
+    'public-read-write': BucketFileBase.SHARE_ACCESS_READWRITE
+}   # 对象访问权限x-amz-acl
 
 
 def exception_response(request, exc):
@@ -180,10 +189,15 @@ class MultipartUploadHandler:
         if upload.is_composing():  # 已经正在组合对象，不能重复组合
             return exception_response(request, exceptions.S3CompleteMultipartAlreadyInProgress())
 
-        if not upload.set_composing():  # 设置正在组合对象
-            return exception_response(request, exceptions.S3InternalError())
+        try:
+            composing = upload.set_composing()  # 设置正在组合对象
+        except Exception as e:
+            return exception_response(request, exceptions.S3InternalError(extend_msg=str(e)))
 
-        hm = HarborManager()
+        if not composing:   # 并发的组合请求已设置
+            return exception_response(request, exceptions.S3CompleteMultipartAlreadyInProgress())
+
+        hm = _HM
         obj, created = hm.get_or_create_obj(table_name=bucket.get_bucket_table_name(), obj_path_name=key)
 
         obj_raods_key = obj.get_obj_key(bucket.id)
@@ -218,20 +232,37 @@ class MultipartUploadHandler:
         if isinstance(parts, dict):
             parts = parts.values()
 
+        parts = list(parts)
         start_time = time.time()
         remove_failed_parts = []  # 删除元数据失败的part
+        if is_rm_metadata and parts:
+            # 一条语句删除所有part元数据，失败时再逐个删除找出删除失败的part
+            try:
+                type(parts[0]).objects.filter(id__in=[p.id for p in parts]).delete()
+            except Exception as e:
+                for p in parts:
+                    if not p.safe_delete():
+                        if not p.safe_delete():  # 重试一次
+                            remove_failed_parts.append(p)
+
+        # part rados数据异步删除，最多PARTS_DELETE_MAX_IN_FLIGHT个part同时删除，删除失败的同步重试一次
         part_rados = build_harbor_object_part(using=using, part_key='', part_size=0)
-        for p in parts:
-            if is_rm_metadata:
-                if not p.safe_delete():
-                    if not p.safe_delete():  # 重试一次
-                        remove_failed_parts.append(p)
+        pending = deque()
 
-            part_rados.reset_part_key_and_size(part_key=p.get_part_rados_key(), part_size=p.size)
-            ok, _ = part_rados.delete()
+        def wait_oldest():
+            wait_part, wait_delete = pending.popleft()
+            ok, _ = wait_delete()
             if not ok:
+                part_rados.reset_part_key_and_size(part_key=wait_part.get_part_rados_key(), part_size=wait_part.size)
                 part_rados.delete()  # 重试一次
 
+        for p in parts:
+            if len(pending) >= PARTS_DELETE_MAX_IN_FLIGHT:
+                wait_oldest()
+
+            part_rados.reset_part_key_and_size(part_key=p.get_part_rados_key(), part_size=p.size)
+            pending.append((p, part_rados.aio_delete(obj_size=p.size)))
+
             # 间隔不断发送空字符防止客户端连接超时
             now_time = time.time()
             if now_time - start_time < 10:
@@ -240,6 +271,9 @@ class MultipartUploadHandler:
 
             yield None
 
+        while pending:
+            wait_oldest()
+
         yield remove_failed_parts
 
     def complete_iter(self, request, bucket, upload, obj, obj_rados, obj_etag, complete_numbers, used_upload_parts,
@@ -284,6 +318,10 @@ class MultipartUploadHandler:
                 else:
                     yield white_space_bytes
 
+            # 批量保存所有part元数据的对象归属字段
+            ObjectPartManager(bucket=bucket).bulk_update_parts(
+                parts=list(used_upload_parts.values()), fields=['obj_offset', 'obj_etag', 'obj_id', 'parts_count'])
+
             # 更新对象元数据
             if not self.update_obj_metedata(obj=obj, size=offset, hex_md5=md5_handler.hex_md5,
                                             share_code=upload.obj_perms_code):
@@ -354,7 +392,7 @@ class MultipartUploadHandler:
     @staticmethod
     def save_part_to_object_iter(obj, obj_rados, part_rados, offset, part, md5_handler, obj_etag: str, parts_count: int):
         """
-        把一个part数据写入对象
+        把一个part数据写入对象，并设置part元数据实例的对象归属字段(不保存，由调用者批量保存)
 
         :param obj: 对象元数据实例
         :param obj_rados: 对象rados实例
@@ -376,32 +414,35 @@ class MultipartUploadHandler:
 
         start_time = time.time()
         part_rados.reset_part_key_and_size(part_key=part.get_part_rados_key(), part_size=part.size)
-        generator = part_rados.read_obj_generator()
-        for data in generator:
-            if not data:
-                break
-
-            ok, msg = obj_rados.write(offset=offset, data_block=data)
-            if not ok:
-                ok, msg = obj_rados.write(offset=offset, data_block=data)
+        # 读part和写对象都异步流水线进行，md5按顺序在当前线程计算
+        generator = part_rados.aio_read_obj_generator(block_size=COMPLETE_MULTIPART_BLOCK_SIZE,
+                                                      depth=COMPLETE_MULTIPART_MAX_IN_FLIGHT)
+        writer = obj_rados.aio_writer(max_in_flight=COMPLETE_MULTIPART_MAX_IN_FLIGHT)
+        try:
+            for data in generator:
+                if not data:
+                    break
 
-            if not ok:
-                yield exceptions.S3InternalError(extend_msg=msg)
+                writer.write(data, offset=offset)
+                md5_handler.update(offset=offset, data=data)
+                offset = offset + len(data)
 
-            md5_handler.update(offset=offset, data=data)
-            offset = offset + len(data)
+                now_time = time.time()
+                if now_time - start_time < 10:
+                    start_time = now_time
+                    continue
 
-            now_time = time.time()
-            if now_time - start_time < 10:
-                start_time = now_time
-                continue
+                yield None
 
-            yield None
+            writer.flush()
+        except RadosError as e:
+            try:
+                writer.flush()
+            except RadosError:
+                pass
 
-        try:
-            part.save(update_fields=['obj_offset', 'obj_etag', 'obj_id', 'parts_count'])
-        except Exception as e:
-            yield exceptions.S3InternalError()
+            yield exceptions.S3InternalError(extend_msg=str(e))
+            return
 
         yield True
 
@@ -471,7 +512,7 @@ class ListObjectsHandler:
             return self.list_objects_v1_no_match(view=view, request=request, prefix=prefix, delimiter=delimiter,
                                                  bucket_name=bucket_name)
 
-        hm = HarborManager()
+        hm = _HM
         try:
             bucket, obj = hm.get_bucket_and_obj_or_dir(bucket_name=bucket_name, path=path, user=request.user)
         except exceptions.S3Error as e:
@@ -501,10 +542,11 @@ class ListObjectsHandler:
             paginator.paginate_queryset(objs_qs, request=request)
             objs, _ = paginator.get_objects_and_dirs()
 
-            serializer = serializers.ObjectListWithOwnerSerializer(objs, many=True, context={'user': request.user})
+            owner = serializers.build_owner(request.user)
+            serializer = serializers.ObjectListWithOwnerSerializer(context={'owner': owner})
             data = paginator.get_paginated_data(common_prefixes=True, delimiter=delimiter)
             ret_data.update(data)
-            ret_data['Contents'] = serializer.data
+            ret_data['Contents'] = list(serializer.iter_representation(objs))
             view.set_renderer(request, renders.ListObjectsV1XMLRenderer())
             return Response(data=ret_data, status=200)
 
@@ -513,7 +555,8 @@ class ListObjectsHandler:
             return self.list_objects_v1_no_match(view=view, request=request, prefix=prefix, delimiter=delimiter,
                                                  bucket_name=bucket_name)
 
-        serializer = serializers.ObjectListWithOwnerSerializer(obj, context={'user': request.user})
+        owner = serializers.build_owner(request.user)
+        serializer = serializers.ObjectListWithOwnerSerializer(obj, context={'owner': owner})
 
         ret_data['Contents'] = [serializer.data]
         ret_data['KeyCount'] = 1
@@ -525,7 +568,7 @@ class ListObjectsHandler:
         """
         列举所有对象和目录
         """
-        hm = HarborManager()
+        hm = _HM
         try:
             bucket, objs_qs = hm.get_bucket_objects_dirs_queryset(bucket_name=bucket_name, user=request.user,
                                                                   prefix=prefix)
@@ -534,10 +577,11 @@ class ListObjectsHandler:
 
         paginator = paginations.ListObjectsV1CursorPagination()
         objs_dirs = paginator.paginate_queryset(objs_qs, request=request)
-        serializer = serializers.ObjectListWithOwnerSerializer(objs_dirs, many=True, context={'user': request.user})
+        owner = serializers.build_owner(request.user)
+        serializer = serializers.ObjectListWithOwnerSerializer(context={'owner': owner})
 
         data = paginator.get_paginated_data(delimiter='')
-        data['Contents'] = serializer.data
+        data['Contents'] = list(serializer.iter_representation(objs_dirs))
         data['Name'] = bucket_name
         data['Prefix'] = prefix
         data['EncodingType'] = 'url'
@@ -619,7 +663,7 @@ class CopyObjectHandler:
 
         :raises: S3Error
         """
-        hm = HarborManager()
+        hm = _HM
         try:
             bucket, obj = hm.get_bucket_and_obj_or_dir(
                 bucket_name=bucket_name, path=obj_key, user=request.user, all_public=True)
@@ -641,7 +685,7 @@ class CopyObjectHandler:
         """
         now_time = timezone.now()
         try:
-            obj = HarborManager().update_obj_metadata_time(obj=obj, create_time=now_time, modified_time=now_time)
+            obj = _HM.update_obj_metadata_time(obj=obj, create_time=now_time, modified_time=now_time)
         except exceptions.S3Error as e:
             return view.exception_response(request, e)
 
@@ -788,7 +832,7 @@ class CopyObjectHandler:
         )
         :raises: S3Error
         """
-        h_manager = HarborManager()
+        h_manager = _HM
         if isinstance(bucket_or_name, str):
             bucket, obj, created = h_manager.create_empty_obj(
                 bucket_name=bucket_or_name, obj_path=obj_key, user=request.user)
@@ -798,8 +842,7 @@ class CopyObjectHandler:
             obj, created = h_manager.get_or_create_obj(collection_name, obj_key)
 
         # 访问权限
-        acl_choices = {'private': BucketFileBase.SHARE_ACCESS_NO, 'public-read': BucketFileBase.SHARE_ACCESS_READONLY,
-                       'public-read-write': BucketFileBase.SHARE_ACCESS_READWRITE}
+        acl_choices = OBJECT_ACL_CHOICES
         x_amz_acl = request.headers.get('X-Amz-Acl', 'private').lower()
         if x_amz_acl not in acl_choices:
             raise exceptions.S3InvalidRequest(f'The value {x_amz_acl} of header "x-amz-acl" is not supported.')
@@ -1,4 +1,5 @@
 from django.utils import timezone
+from django.conf import settings
 from django.db.models import Case, Value, When, F
 from django.db.models import BigIntegerField
 
@@ -10,6 +11,10 @@ from .managers import ObjectPartManager
 from .utils import BucketFileManagement
 
 
+GET_OBJECT_READ_AHEAD_BYTES = getattr(settings, 'S3_GET_OBJECT_READ_AHEAD_BYTES', 32 * 1024 ** 2)    # default 32MB
+DELETE_OBJECTS_BATCH_SIZE = 100     # 删除多个对象时，每批一次查询元数据、一次删除元数据，rados数据同时异步删除
+
+
 class HarborManager:
     """
     操作harbor对象数据和元数据管理接口封装
@@ -38,7 +43,7 @@ class HarborManager:
             Bucket() # success
             None     # not exist
         """
-        bucket = Bucket.get_bucket_by_name(name)
+        bucket = Bucket.get_bucket_by_name_cached(name)
         if not bucket:
             return None
 
@@ -911,7 +916,8 @@ class HarborManager:
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
         rados = build_harbor_object(using=bucket.ceph_using, pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
-        return rados.read_obj_generator(offset=offset, end=end, block_size=per_size)
+        depth = max(GET_OBJECT_READ_AHEAD_BYTES // per_size, 1)
+        return rados.aio_read_obj_generator(offset=offset, end=end, block_size=per_size, depth=depth)
 
     def get_write_generator(self, bucket_name: str, obj_path: str, user=None):
         """
@@ -1200,46 +1206,112 @@ class HarborManager:
             err_deleted_objs like [{"Code": "xxx", "Message": "xxx", "Key": "xxx"}, ]
         """
         bucket = self.get_public_or_user_bucket(name=bucket_name, user=user)
-        table_name = bucket.get_bucket_table_name()
+        bfm = BucketFileManagement(collection_name=bucket.get_bucket_table_name())
 
         deleted_objects = []
         not_delete_objects = []
-        for item in obj_keys:
-            obj_key = key = item.get('Key', '')
-            if key.endswith('/'):       # 目录
-                key_is_dir = True
-                obj_key = key.rstrip('/')
-            else:
-                key_is_dir = False
+        for i in range(0, len(obj_keys), DELETE_OBJECTS_BATCH_SIZE):
+            keys = [item.get('Key', '') for item in obj_keys[i:i + DELETE_OBJECTS_BATCH_SIZE]]
+            errors = self._delete_objects_batch(bucket=bucket, bfm=bfm, keys=keys)
+            for key, e in zip(keys, errors):
+                if e is None:
+                    deleted_objects.append({"Key": key})
+                else:
+                    err = e.err_data()
+                    err['Key'] = key
+                    not_delete_objects.append(err)
 
-            try:
-                try:
-                    obj = self.get_metadata_obj(table_name=table_name, path=obj_key)    # 不检查父路径
-                except Exception as e:
-                    if not isinstance(e, exceptions.S3Error):
-                        raise exceptions.S3InternalError(f'查询对象元数据错误，{str(e)}')
-                    raise e
+        return deleted_objects, not_delete_objects
+
+    def _delete_objects_batch(self, bucket, bfm, keys: list):
+        """
+        删除一批对象，对象元数据一次查询、一次删除，rados数据同时异步删除；目录逐个删除
 
-                if not obj:
-                    raise exceptions.S3NoSuchKey()
+        不存在的对象视为删除成功
+        :param bucket: 桶实例
+        :param bfm: BucketFileManagement()
+        :param keys: 对象全路径列表；["xxx", ]
+        :return:
+            list    # 与keys一一对应，None(删除成功) or S3Error()
+        """
+        paths = [key.rstrip('/') if key.endswith('/') else key for key in keys]
+        try:
+            objs_map = bfm.get_objs_by_paths(paths=list(set(paths)))     # 不检查父路径
+        except Exception as e:
+            return [exceptions.S3InternalError(f'查询对象元数据错误，{str(e)}') for _ in keys]
+
+        errors = [None] * len(keys)
+        files = {}      # obj.id -> obj, 要删除的对象
+        file_indexes = []   # (index, obj.id)
+        for i, (key, path) in enumerate(zip(keys, paths)):
+            objs = objs_map.get(path)
+            if not objs:
+                continue
+
+            if len(objs) > 1:
+                errors[i] = exceptions.S3InternalError(
+                    f'查询对象元数据错误，数据库表{bfm.get_collection_name()}中存在多个相同的目录：{path}')
+                continue
 
-                if (key_is_dir and obj.is_dir()) or (not key_is_dir and obj.is_file()):
+            obj = objs[0]
+            if key.endswith('/'):       # 目录
+                if obj.is_dir():
                     try:
                         self.do_delete_obj_or_dir(bucket=bucket, obj=obj)
                     except exceptions.S3Error as e:
-                        raise e
+                        errors[i] = e
+            elif obj.is_file():
+                files[obj.id] = obj
+                file_indexes.append((i, obj.id))
 
-                    deleted_objects.append({"Key": key})
-                else:
-                    raise exceptions.S3NoSuchKey()
-            except exceptions.S3NoSuchKey as e:
-                deleted_objects.append({"Key": key})
-            except exceptions.S3Error as e:
-                err = e.err_data()
-                err['Key'] = key
-                not_delete_objects.append(err)
+        if files:
+            file_errors = self.do_delete_objects(bucket=bucket, objs=list(files.values()))
+            for i, obj_id in file_indexes:
+                errors[i] = file_errors.get(obj_id)
 
-        return deleted_objects, not_delete_objects
+        return errors
+
+    @staticmethod
+    def do_delete_objects(bucket, objs: list):
+        """
+        删除多个对象（非目录），一次删除元数据，rados数据同时异步删除，rados数据删除失败的对象恢复元数据
+
+        :param bucket: 桶实例
+        :param objs: 对象元数据实例列表，同一个表的对象
+        :return:
+            dict    # 删除失败的对象，{obj.id: S3Error()}
+        """
+        model = type(objs[0])
+        ids = [obj.id for obj in objs]
+        # 先删除元数据，后删除rados对象（删除失败恢复元数据）
+        try:
+            model.objects.filter(id__in=ids).delete()
+        except Exception as e:
+            return {obj_id: exceptions.S3InternalError('删除对象原数据时错误') for obj_id in ids}
+
+        # 先提交所有rados对象异步删除，再逐个等待删除完成
+        pool_name = bucket.get_pool_name()
+        waits = []
+        for obj in objs:
+            ho = build_harbor_object(using=bucket.ceph_using, pool_name=pool_name,
+                                     obj_id=obj.get_obj_key(bucket.id), obj_size=obj.si)
+            waits.append((obj, ho.aio_delete()))
+
+        errors = {}
+        deleted_ids = []
+        for obj, wait_delete in waits:
+            ok, _ = wait_delete()
+            if not ok:
+                obj.do_save(force_insert=True)  # 恢复元数据，仅尝试创建文档，不修改已存在文档
+                errors[obj.id] = exceptions.S3InternalError('删除对象rados数据时错误')
+            else:
+                deleted_ids.append(obj.id)
+
+        # 只删除rados数据已删除的对象的part元数据，恢复了元数据的对象保留其part元数据
+        if deleted_ids and bucket.is_s3_bucket():
+            ObjectPartManager(parts_table_name=bucket.get_parts_table_name()).remove_objects_parts(obj_ids=deleted_ids)
+
+        return errors
 
     @staticmethod
     def do_delete_obj_or_dir(bucket, obj):
@@ -1266,12 +1338,15 @@ class HarborManager:
         if obj.is_dir():
             return True
 
+        # 先提交rados对象异步删除，等待删除完成期间删除对象的part元数据
+        pool_name = bucket.get_pool_name()
+        ho = build_harbor_object(using=bucket.ceph_using, pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
+        wait_delete = ho.aio_delete()
+
         if bucket.is_s3_bucket():
             ObjectPartManager(parts_table_name=bucket.get_parts_table_name()).remove_object_parts(obj_id=old_id)
 
-        pool_name = bucket.get_pool_name()
-        ho = build_harbor_object(using=bucket.ceph_using, pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
-        ok, _ = ho.delete()
+        ok, _ = wait_delete()
         if not ok:
             # 恢复元数据
             obj.id = old_id
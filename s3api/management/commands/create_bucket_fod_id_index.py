@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from s3api.utils import get_obj_model_class, is_model_table_exists
+from buckets.models import Bucket
+
+
+INDEX_NAME = 'fod_id_idx'
+
+
+class Command(BaseCommand):
+    """
+    为已存在的存储桶对象元数据表添加(fod, -id)索引
+    """
+
+    help = """** manage.py create_bucket_fod_id_index --bucket-name="s36" **    
+           **  manage.py create_bucket_fod_id_index --all ** 
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default='', dest='bucket-name', type=str,
+            help='Create index for this bucket.',
+        )
+        parser.add_argument(
+            '--all', default=False, nargs='?', dest='all', type=bool, const=True,    # 当命令行有此参数时取值const, 否则取值default
+            help='Create index for all buckets.',
+        )
+
+    def handle(self, *args, **options):
+        bucket_name = options['bucket-name']
+        if bucket_name:
+            buckets = Bucket.objects.filter(name=bucket_name).all()
+        elif options['all']:
+            buckets = Bucket.objects.all()
+        else:
+            raise CommandError("Need argument --bucket-name or --all.")
+
+        if input('Are you sure to create index for the bucket tables?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
+            raise CommandError("cancelled.")
+
+        for bucket in buckets:
+            table_name = bucket.get_bucket_table_name()
+            try:
+                created = self.create_index(table_name=table_name)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Failed to create index for bucket {bucket.name}, {str(e)}'))
+                continue
+
+            if created:
+                self.stdout.write(self.style.SUCCESS(f'Create index for bucket {bucket.name} Successfully.'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Index already exists or table not exists, bucket {bucket.name}.'))
+
+    @staticmethod
+    def create_index(table_name: str):
+        """
+        :return:
+            True    # 创建了索引
+            False   # 表不存在或索引已存在
+        :raises: Exception
+        """
+        model_class = get_obj_model_class(table_name)
+        if not is_model_table_exists(model_class):
+            return False
+
+        using = router.db_for_write(model_class)
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table_name)
+        if INDEX_NAME in constraints:
+            return False
+
+        index = [i for i in model_class._meta.indexes if i.name == INDEX_NAME][0]
+        with connection.schema_editor() as schema_editor:
+            schema_editor.add_index(model_class, index)
+
+        return True
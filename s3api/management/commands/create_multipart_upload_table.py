@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
+from django.db import router, connections
 
 from s3api.utils import (create_table_for_model_class, is_model_table_exists, delete_table_for_model_class)
 from s3api.models import MultipartUpload
@@ -11,6 +12,7 @@ class Command(BaseCommand):
 
     help = """** manage.py create_multipart_upload_table" **    
            **  manage.py create_multipart_upload_table --delete" ** 
+           **  manage.py create_multipart_upload_table --convert-key-md5" ** 
         """
 
     def add_arguments(self, parser):
@@ -18,11 +20,22 @@ class Command(BaseCommand):
             '--delete', default=False, nargs='?', dest='delete', type=bool, const=True,    # 当命令行有此参数时取值const, 否则取值default
             help='The table will be delete if use this argument',
         )
+        parser.add_argument(
+            '--convert-key-md5', default=False, nargs='?', dest='convert-key-md5', type=bool, const=True,
+            help='Convert column key_md5 of the existing table from hex CHAR(32) to BINARY(16)',
+        )
 
     def handle(self, *args, **options):
         delete = options['delete']
         MultipartUpload._meta.managed = True
         exists = is_model_table_exists(MultipartUpload)
+        if options['convert-key-md5']:
+            if not exists:
+                raise CommandError("The table is not exists.")
+
+            self.convert_key_md5()
+            return
+
         if delete:
             if exists:
                 if input('Are you sure to delete the table?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
@@ -48,3 +61,26 @@ class Command(BaseCommand):
                     self.stdout.write(self.style.SUCCESS('Create the table Successfully.'))
                 else:
                     self.stdout.write(self.style.ERROR('Failed to create the table'))
+
+    def convert_key_md5(self):
+        """
+        已存在的表key_md5列由32位hex字符串转为16字节二进制
+        """
+        if input('Are you sure to convert column key_md5 of the table?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
+            raise CommandError("cancelled.")
+
+        table_name = MultipartUpload._meta.db_table
+        sqls = [
+            f"ALTER TABLE `{table_name}` MODIFY COLUMN `key_md5` VARBINARY(32) NOT NULL;",
+            f"UPDATE `{table_name}` SET `key_md5` = UNHEX(`key_md5`) WHERE LENGTH(`key_md5`) = 32;",
+            f"ALTER TABLE `{table_name}` MODIFY COLUMN `key_md5` BINARY(16) NOT NULL;"
+        ]
+        using = router.db_for_write(MultipartUpload)
+        try:
+            with connections[using].cursor() as cursor:
+                for sql in sqls:
+                    cursor.execute(sql)
+        except Exception as e:
+            raise CommandError(f'Failed to convert column key_md5, {str(e)}')
+
+        self.stdout.write(self.style.SUCCESS('Convert column key_md5 Successfully.'))
@@ -5,12 +5,40 @@ from django.apps import apps
 from django.core.exceptions import MultipleObjectsReturned
 from django.utils import timezone
 
-from utils.md5 import get_str_hexMD5
+from utils.md5 import get_str_bytesMD5
 from s3api.models import ObjectPartBase, MultipartUpload
 from . import exceptions
 
 
 logger = logging.getLogger('django.request')    # 这里的日志记录器要和setting中的loggers选项对应，不能随意给参
+_key_md5_converted = False      # 多部分上传表key_md5列已转为BINARY(16)，检查通过后每个进程不再检查
+
+
+def check_key_md5_converted():
+    """
+    确认多部分上传表key_md5列已转为BINARY(16)；未转换时hex格式的旧记录查询不到，新记录也写不进去，
+    直接报错，提示先执行 manage.py create_multipart_upload_table --convert-key-md5
+
+    :raises: S3Error
+    """
+    global _key_md5_converted
+    if _key_md5_converted:
+        return
+
+    from .utils import get_model_column_type
+
+    try:
+        data_type = get_model_column_type(MultipartUpload, 'key_md5')
+    except Exception as e:
+        raise exceptions.S3InternalError(extend_msg=f'check column key_md5 error, {str(e)}')
+
+    if data_type != 'binary':
+        msg = f'Column key_md5 of table {MultipartUpload._meta.db_table} is "{data_type}", not converted to binary, ' \
+              f'run "manage.py create_multipart_upload_table --convert-key-md5" first.'
+        logger.error(msg)
+        raise exceptions.S3InternalError(extend_msg=msg)
+
+    _key_md5_converted = True
 
 
 def get_parts_model_class(table_name):
@@ -39,6 +67,24 @@ def get_parts_model_class(table_name):
     return type(model_name, (ObjectPartBase,), {'Meta': meta, '__module__': ObjectPartBase.__module__})
 
 
+def preload_parts_model_classes():
+    """
+    为所有已存在的存储桶预先创建对象part模型类，避免请求时并发创建模型类竞争apps注册锁；
+    之后新创建的存储桶仍通过get_parts_model_class按需创建
+
+    :return:
+        int     # 预创建的模型类数量
+    """
+    from buckets.models import Bucket, build_parts_tablename
+
+    count = 0
+    for bucket_id in Bucket.objects.values_list('id', flat=True).iterator():
+        get_parts_model_class(build_parts_tablename(bucket_id))
+        count += 1
+
+    return count
+
+
 def create_multipart_upload_task(bucket, obj_key: str, obj_perms_code: int, obj_id: int = 0, expire_time=None):
     """
     创建一个多部分上传记录
@@ -56,6 +102,7 @@ def create_multipart_upload_task(bucket, obj_key: str, obj_perms_code: int, obj_
     if expire_time is None:
         expire_time = timezone.now() + timedelta(days=30)  # 默认一个月到期
 
+    check_key_md5_converted()
     try:
         upload = MultipartUpload(bucket_id=bucket.id, bucket_name=bucket.name, obj_id=obj_id,
                                  obj_key=obj_key, expire_time=expire_time, obj_perms_code=obj_perms_code)
@@ -98,6 +145,7 @@ def update_upload_belong_to_object(upload, bucket, obj_key: str, obj_perms_code:
         need_update.append('obj_id')
 
     if self.obj_key != obj_key:
+        check_key_md5_converted()
         self.obj_key = obj_key
         self.reset_key_md5()
         need_update.append('obj_key')
@@ -144,7 +192,8 @@ class MultipartUploadManager:
 
         :raises: S3Error
         """
-        key_md5 = get_str_hexMD5(obj_path)
+        check_key_md5_converted()
+        key_md5 = get_str_bytesMD5(obj_path)
         try:
             return MultipartUpload.objects.filter(key_md5=key_md5, bucket_name=bucket_name, obj_key=obj_path).all()
         except Exception as e:
@@ -183,23 +232,18 @@ class MultipartUploadManager:
         :raises: S3Error
         """
         qs = self.get_multipart_upload_queryset(bucket_name=bucket.name, obj_path=obj_path)
-        valid_uploads = []
         try:
-            for upload in qs:
-                if not upload.belong_to_bucket(bucket):
-                    try:
-                        upload.delete()
-                    except Exception as e:
-                        pass
-                else:
-                    valid_uploads.append(upload)
+            # 桶名相同、桶id不同的记录属于已删除的同名桶，无效
+            valid_upload = qs.filter(bucket_id=bucket.id).order_by('id').first()
         except Exception as e:
             raise exceptions.S3InternalError(extend_msg='select multipart upload error.')
 
-        if len(valid_uploads) == 0:
-            return None
+        try:
+            qs.exclude(bucket_id=bucket.id).delete()
+        except Exception as e:
+            pass
 
-        return valid_uploads[0]
+        return valid_upload
 
     @staticmethod
     def create_multipart_upload_task(bucket, obj_key: str, obj_perms_code: int, obj_id: int = 0, expire_time=None):
@@ -222,7 +266,7 @@ class ObjectPartManager:
         """
         self.__parts_table_name = parts_table_name
         self.bucket = bucket
-        self._parts_model_class = self.creat_parts_model_class()
+        self._parts_model_class = None
 
     def creat_parts_model_class(self):
         """
@@ -299,6 +343,20 @@ class ObjectPartManager:
         model = self.get_parts_model_class()
         return model.objects.filter(obj_id=obj_id).all()
 
+    def get_obj_etag_part(self, obj_id: int):
+        """
+        查询对象的任意一个part，只用于获取多部分对象的ETag和part总数（每个part记录的相同）；
+        只加载需要的列，不排序，索引obj_id_idx命中第一条即返回
+
+        :param obj_id: 对象id
+        :return:
+            part    # 只有obj_etag、parts_count字段
+            None    # 非多部分对象
+        """
+        model = self.get_parts_model_class()
+        parts = list(model.objects.filter(obj_id=obj_id).only('id', 'obj_etag', 'parts_count').order_by()[:1])
+        return parts[0] if parts else None
+
     def create_part_metadata(self, upload_id: str, obj_id: int, part_num: int, size: int, part_md5: str, **kwargs):
         """
         创建一个对象部分元数据
@@ -341,5 +399,38 @@ class ObjectPartManager:
 
         return True
 
+    def bulk_update_parts(self, parts, fields: list, batch_size: int = 500):
+        """
+        批量更新多个part元数据的字段
+
+        :param parts: part元数据实例list
+        :param fields: 要更新的字段名list
+        :param batch_size: 每条UPDATE语句更新的part数
+        :raises: S3Error
+        """
+        model = self.get_parts_model_class()
+        try:
+            model.objects.bulk_update(parts, fields=fields, batch_size=batch_size)
+        except Exception as e:
+            msg = f'bulk update {self.parts_table_name()}, fields={fields}, err={str(e)}'
+            logger.error(msg)
+            raise exceptions.S3InternalError(message='Failed to update part metadata.')
+
+    def remove_objects_parts(self, obj_ids: list):
+        """
+        删除多个对象的part元数据
+        :param obj_ids: 对象id列表
+        :return:
+            True
+            False
+        """
+        model = self.get_parts_model_class()
+        try:
+            r = model.objects.filter(obj_id__in=obj_ids).delete()
+        except Exception as e:
+            return False
+
+        return True
+
 
 
@@ -5,7 +5,7 @@ from _datetime import datetime
 from django.db import models
 from django.utils import timezone
 
-from utils.md5 import get_str_hexMD5
+from utils.md5 import get_str_bytesMD5
 
 
 def uuid1_uuid4_hex_string():
@@ -40,6 +40,27 @@ def get_datetime_from_upload_id(upload_id: str):
     return datetime.fromtimestamp(f, tz=timezone.utc)
 
 
+class BinaryMD5Field(models.BinaryField):
+    """
+    16字节定长二进制MD5字段, BINARY(16)可直接建索引
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs['max_length'] = 16
+        super().__init__(*args, **kwargs)
+
+    def db_type(self, connection):
+        if connection.vendor == 'mysql':
+            return 'binary(16)'
+
+        return super().db_type(connection)
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, (bytearray, memoryview)):
+            return bytes(value)
+
+        return value
+
+
 class MultipartUpload(models.Model):
     """
     一个多部分上传任务
@@ -58,7 +79,7 @@ class MultipartUpload(models.Model):
     bucket_name = models.CharField(verbose_name='bucket name', max_length=63, default='')
     obj_id = models.BigIntegerField(verbose_name='object id', default=0, help_text='组合对象后为对象id, 默认为0表示还未组合对象')
     obj_key = models.CharField(verbose_name='object key', max_length=1024, default='')
-    key_md5 = models.CharField(max_length=32, verbose_name='object key MD5')
+    key_md5 = BinaryMD5Field(verbose_name='object key MD5')
     create_time = models.DateTimeField(verbose_name='创建时间', auto_now_add=True)
     expire_time = models.DateTimeField(verbose_name='对象过期时间', null=True, default=None, help_text='上传过程终止时间')
     status = models.SmallIntegerField(verbose_name='状态', choices=STATUS_CHOICES, default=STATUS_UPLOADING)
@@ -79,12 +100,12 @@ class MultipartUpload(models.Model):
         """
         na更改时，计算并重设新的key_md5
 
-        :return: str
+        :return: None, key_md5为16字节二进制MD5
 
         :备注：不会自动更新的数据库
         """
         key = self.obj_key if self.obj_key else ''
-        self.key_md5 = get_str_hexMD5(key)
+        self.key_md5 = get_str_bytesMD5(key)
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if not self.id:
@@ -162,16 +183,20 @@ class MultipartUpload(models.Model):
     def set_composing(self):
         """
         设置为正在组合对象
+
+        条件更新(status == STATUS_UPLOADING)，并发的重复组合请求只有一个能设置成功
         :return:
-            True or False
+            True        # 设置成功
+            False       # 已被其他请求设置(不是正在上传状态)
+
+        :raises: Exception  # 数据库错误
         """
-        if self.status != self.STATUS_COMPOSING:
-            self.status = self.STATUS_COMPOSING
-            try:
-                self.save(update_fields=['status'])
-            except Exception as e:
-                return False
+        rows = MultipartUpload.objects.filter(
+            id=self.id, status=self.STATUS_UPLOADING).update(status=self.STATUS_COMPOSING)
+        if rows != 1:
+            return False
 
+        self.status = self.STATUS_COMPOSING
         return True
 
     def set_completed(self):
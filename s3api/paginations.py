@@ -1,16 +1,25 @@
+import binascii
+from collections import namedtuple
+from base64 import b64encode, urlsafe_b64encode, urlsafe_b64decode
 from urllib import parse
 
 from django.utils.encoding import force_str
 from django.utils.translation import gettext as _
-from rest_framework.pagination import CursorPagination, Cursor
+from rest_framework.pagination import BasePagination, CursorPagination, Cursor
 from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
 
+from utils.md5 import EMPTY_HEX_MD5
 from .managers import MultipartUploadManager
 from .models import get_datetime_from_upload_id
 from . import exceptions
 from .harbor import HarborManager
 
 
+_HM = HarborManager()   # 无状态，所有请求共用
+_MUM = MultipartUploadManager()   # 无状态，所有请求共用
+
+
 def get_query_param(url, key):
     """
     get query param form url
@@ -25,9 +34,79 @@ def get_query_param(url, key):
     return query_dict.get(key, None)
 
 
-class ListObjectsV2CursorPagination(CursorPagination):
+class FileRow(namedtuple('FileRow', ['id', 'na', 'si', 'md5', 'upt', 'ult', 'fod'])):
+    """
+    对象列举只读的元数据行，替代模型实例，字段和BucketFileBase同名
+    """
+    __slots__ = ()
+
+    def is_file(self):
+        return self.fod
+
+    def is_dir(self):
+        return not self.fod
+
+    @property
+    def obj_size(self):
+        return self.si
+
+    @property
+    def hex_md5(self):
+        if not self.fod or self.si == 0:
+            return EMPTY_HEX_MD5
+
+        return self.md5
+
+
+def encode_cursor_token(cursor):
+    """
+    游标编码为分页参数值，与CursorPagination.encode_cursor()中的编码一致
+
+    :param cursor: Cursor()
+    :return: str
+    """
+    tokens = {}
+    if cursor.offset != 0:
+        tokens['o'] = str(cursor.offset)
+    if cursor.reverse:
+        tokens['r'] = '1'
+    if cursor.position is not None:
+        tokens['p'] = cursor.position
+
+    querystring = parse.urlencode(tokens, doseq=True)
+    return b64encode(querystring.encode('ascii')).decode('ascii')
+
+
+def build_common_prefix(paginator, dirs, delimiter):
+    """
+    目录列表转为CommonPrefixes，结果按delimiter缓存在分页器上
+
+    :param paginator: 分页器实例
+    :param dirs: 目录元数据列表
+    :param delimiter: 分隔符
+    :return:
+        [{"Prefix": "xxx/"}, ...]
+    """
+    cache = getattr(paginator, '_common_prefix_cache', None)
+    if cache is None:
+        cache = paginator._common_prefix_cache = {}
+
+    common_prefix = cache.get(delimiter)
+    if common_prefix is None:
+        dl = len(delimiter)
+        common_prefix = [{"Prefix": na if na[-dl:] == delimiter else na + delimiter} for na in (d.na for d in dirs)]
+        cache[delimiter] = common_prefix
+
+    return common_prefix
+
+
+class ListObjectsV2CursorPagination(BasePagination):
     """
     存储通文件对象分页器
+
+    按id倒序的keyset分页，continuation-token为上一页最后一条记录id的url安全base64编码，
+    每页一条SQL: WHERE id < :token ORDER BY id DESC LIMIT max_keys+1
+    分页数据为只读的FileRow，不是模型实例
     """
     cursor_query_param = 'continuation-token'
     cursor_query_description = 'The pagination continuation-token value.'
@@ -39,7 +118,6 @@ class ListObjectsV2CursorPagination(CursorPagination):
     page_size_query_description = 'Max number of results to return per page.'
 
     max_page_size = 1000
-    offset_cutoff = 0
 
     start_after_query_param = 'start-after'  # used if no cursor_query_param
 
@@ -56,12 +134,39 @@ class ListObjectsV2CursorPagination(CursorPagination):
             raise ValueError('Invalid param "context", one of "bucket" and "bucket_name" needs to be in it.')
 
         self._context = context
+        self.has_next = False
+        self._next_id = None
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size) if self.max_page_size else size
+            except (KeyError, ValueError):
+                pass
+
+        return self.page_size
 
     def paginate_queryset(self, queryset, request, view=None):
         self.request = request
-        data = super().paginate_queryset(queryset=queryset, request=request, view=view)
-        if data is None:
-            data = []
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(id__lt=position)
+
+        if tuple(queryset.query.order_by) != (self.ordering,):     # 调用者已按-id排序时不再重复order_by
+            queryset = queryset.order_by(self.ordering)
+
+        rows = queryset.values_list(*FileRow._fields)[:self.page_size + 1]
+        data = [FileRow._make(r) for r in rows]
+        self.has_next = len(data) > self.page_size
+        if self.has_next:
+            data = data[:self.page_size]
+            self._next_id = data[-1].id
+        else:
+            self._next_id = None
+
         self._data = data
         self.key_count = len(self._data)
         return self._data
@@ -75,28 +180,14 @@ class ListObjectsV2CursorPagination(CursorPagination):
 
     def get_objects_and_dirs(self):
         if not hasattr(self, 'objects') or not hasattr(self, 'dirs'):
-            objects = []
-            dirs = []
             data = self.page_data
-            for obj in data:
-                if obj.is_file():
-                    objects.append(obj)
-                else:
-                    dirs.append(obj)
-            self.objects = objects
-            self.dirs = dirs
+            self.objects = [obj for obj in data if obj.fod]    # fod: True(对象), False(目录)
+            self.dirs = [obj for obj in data if not obj.fod]
 
         return self.objects, self.dirs
 
     def get_common_prefix(self, delimiter='/'):
-        common_prefix = []
-        for d in self.dirs:
-            na = d.na
-            if not na.endswith(delimiter):
-                na = na + delimiter
-            common_prefix.append({"Prefix": na})
-
-        return common_prefix
+        return build_common_prefix(self, dirs=self.dirs, delimiter=delimiter)
 
     def get_paginated_data(self, common_prefixes=False, delimiter='/'):
         is_truncated = 'true' if self.has_next else 'false'
@@ -122,24 +213,48 @@ class ListObjectsV2CursorPagination(CursorPagination):
         return request.query_params.get(self.cursor_query_param, None)
 
     def get_next_continuation_token(self):
-        next_link = self.get_next_link()
-        if next_link is None:
+        if not self.has_next or self._next_id is None:
             return None
 
-        params = get_query_param(url=next_link, key=self.cursor_query_param)
-        if not params:
+        return self.encode_token(self._next_id)
+
+    @staticmethod
+    def encode_token(position: int):
+        return urlsafe_b64encode(str(position).encode('ascii')).decode('ascii')
+
+    @staticmethod
+    def decode_token(token: str):
+        """
+        :return:
+            int or None
+
+        :raises: ValueError
+        """
+        s = urlsafe_b64decode(token.encode('ascii')).decode('ascii')
+        if s.isdigit():
+            return int(s)
+
+        # 兼容之前CursorPagination格式的token, 'p=xx'
+        params = parse.parse_qs(s, keep_blank_values=True)
+        position = params.get('p', [None])[0]
+        if position is None:
             return None
 
-        return params[0]
+        return int(position)
 
     def decode_cursor(self, request):
-        try:
-            cursor = super().decode_cursor(request)
-        except NotFound as e:
-            raise exceptions.S3InvalidArgument(message=_('无效的参数continuation-token'))
+        """
+        :return:
+            int or None     # 分页起始位置id，不包含
 
-        if cursor:
-            return cursor
+        :raises: S3Error
+        """
+        token = request.query_params.get(self.cursor_query_param, None)
+        if token:
+            try:
+                return self.decode_token(token)
+            except (ValueError, TypeError, binascii.Error):
+                raise exceptions.S3InvalidArgument(message=_('无效的参数continuation-token'))
 
         start_after = request.query_params.get(self.start_after_query_param, None)
         if not start_after:
@@ -147,25 +262,24 @@ class ListObjectsV2CursorPagination(CursorPagination):
 
         start_after = start_after.strip('/')
         if start_after:
-            cursor = self._get_start_after_cursor(start_after=start_after)
-            return cursor
+            return self._get_start_after_position(start_after=start_after)
 
         return None
 
-    def _get_start_after_cursor(self, start_after):
+    def _get_start_after_position(self, start_after):
         """
-        获取分页起始参数start_after对应的游标cursor
+        获取分页起始参数start_after对应的起始位置id
 
         :param start_after: 对象Key
         :return:
-            Cursor() or None
+            int or None
 
         :raises: S3Error
         """
-        hm = HarborManager()
+        hm = _HM
         bucket = self._context.get('bucket', None)
         if not bucket:
-            bucket_name = self._context('bucket_name')
+            bucket_name = self._context.get('bucket_name')
             bucket = hm.get_bucket(bucket_name=bucket_name)
 
         if not bucket:
@@ -173,24 +287,14 @@ class ListObjectsV2CursorPagination(CursorPagination):
 
         table_name = bucket.get_bucket_table_name()
         try:
-            obj = HarborManager().get_metadata_obj(table_name=table_name, path=start_after)
+            obj = hm.get_metadata_obj(table_name=table_name, path=start_after)
         except exceptions.S3Error as e:
             raise e
 
         if not obj:
             raise exceptions.S3NoSuchKey(_('无效的参数start_after'))
 
-        order = self.ordering[0]
-        is_reversed = order.startswith('-')
-        attr = obj.id  # order by id
-        if is_reversed:  # 倒序
-            position = max(attr - 1, 0)
-            reverse = False
-        else:
-            position = attr + 1
-            reverse = True
-
-        return Cursor(offset=0, reverse=reverse, position=position)
+        return obj.id   # order by -id
 
 
 class ListObjectsV1CursorPagination(CursorPagination):
@@ -217,6 +321,7 @@ class ListObjectsV1CursorPagination(CursorPagination):
 
     def paginate_queryset(self, queryset, request, view=None):
         self.request = request
+        queryset = queryset.only(*FileRow._fields)      # 列举对象只需要这些字段，其他列不加载
         data = super().paginate_queryset(queryset=queryset, request=request, view=view)
         if data is None:
             data = []
@@ -233,16 +338,9 @@ class ListObjectsV1CursorPagination(CursorPagination):
 
     def get_objects_and_dirs(self):
         if not hasattr(self, 'objects') or not hasattr(self, 'dirs'):
-            objects = []
-            dirs = []
             data = self.page_data
-            for obj in data:
-                if obj.is_file():
-                    objects.append(obj)
-                else:
-                    dirs.append(obj)
-            self.objects = objects
-            self.dirs = dirs
+            self.objects = [obj for obj in data if obj.fod]    # fod: True(对象), False(目录)
+            self.dirs = [obj for obj in data if not obj.fod]
 
         return self.objects, self.dirs
 
@@ -250,14 +348,7 @@ class ListObjectsV1CursorPagination(CursorPagination):
         if not delimiter:
             delimiter = '/'
 
-        common_prefix = []
-        for d in self.dirs:
-            na = d.na
-            if not na.endswith(delimiter):
-                na = na + delimiter
-            common_prefix.append({"Prefix": na})
-
-        return common_prefix
+        return build_common_prefix(self, dirs=self.dirs, delimiter=delimiter)
 
     def get_paginated_data(self, common_prefixes=False, delimiter=None):
         is_truncated = 'true' if self.has_next else 'false'
@@ -283,15 +374,18 @@ class ListObjectsV1CursorPagination(CursorPagination):
         return request.query_params.get(self.cursor_query_param, None)
 
     def get_next_marker(self):
-        next_link = self.get_next_link()
-        if next_link is None:
-            return None
+        self._encode_token_only = True      # get_next_link()直接返回编码后的游标，不需要构建和解析url
+        try:
+            return self.get_next_link()
+        finally:
+            self._encode_token_only = False
 
-        params = get_query_param(url=next_link, key=self.cursor_query_param)
-        if not params:
-            return None
+    def encode_cursor(self, cursor):
+        token = encode_cursor_token(cursor)
+        if getattr(self, '_encode_token_only', False):
+            return token
 
-        return params[0]
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
 
     def decode_cursor(self, request):
         try:
@@ -381,7 +475,7 @@ class ListUploadsCursorPagination(CursorPagination):
         position = None
         if key_marker:
             try:
-                upload = MultipartUploadManager().get_multipart_upload_delete_invalid(bucket=bucket, obj_path=key_marker)
+                upload = _MUM.get_multipart_upload_delete_invalid(bucket=bucket, obj_path=key_marker)
             except exceptions.S3Error as e:
                 raise e
 
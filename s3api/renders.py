@@ -1,4 +1,5 @@
 from io import StringIO
+from types import GeneratorType
 
 from django.utils.encoding import force_str
 from django.utils.xmlutils import SimplerXMLGenerator
@@ -13,13 +14,16 @@ class CusXMLRenderer(XMLRenderer):
 
 
 class ListObjectsV2XMLRenderer(XMLRenderer):
+    """
+    Contents可以是生成器，渲染时逐项生成逐项写入，不需要先构建整个列表
+    """
     def __init__(self, root_tag_name: str = 'ListBucketResult'):
         self.root_tag_name = root_tag_name
         self.item_tag_name = "list-item"
         self.cur_item_tag_name = self.item_tag_name
 
     def _to_xml(self, xml, data):
-        if isinstance(data, (list, tuple)):
+        if isinstance(data, (list, tuple, GeneratorType)):
             for item in data:
                 xml.startElement(self.cur_item_tag_name, {})
                 self._to_xml(xml, item)
@@ -1,9 +1,15 @@
+from collections import OrderedDict
+
 from django.utils.timezone import utc
 from rest_framework import serializers
 
 from utils.time import GMT_FORMAT
 
 
+_GMT_FIELD = serializers.DateTimeField(format=GMT_FORMAT, default_timezone=utc)      # 模块级单例，避免每次序列化都构造字段
+_ISO_FIELD = serializers.DateTimeField(default_timezone=utc)
+
+
 def time_to_gmt(value):
     """
     :param value: datetime()
@@ -11,11 +17,48 @@ def time_to_gmt(value):
         GMT time string
     """
     try:
-        return serializers.DateTimeField(format=GMT_FORMAT, default_timezone=utc).to_representation(value)
+        return _GMT_FIELD.to_representation(value)
     except Exception as e:
         return ''
 
 
+def time_to_iso_utc(value):
+    """
+    同_ISO_FIELD.to_representation()，列举对象时每行都要调用，直接转换，不经过DRF字段
+
+    :param value: datetime()
+    :return:
+        ISO 8601 UTC time string; None
+    """
+    if not value:
+        return None
+
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=utc)
+    elif value.tzinfo is not utc:       # 数据库读取的时间已是utc时区
+        value = value.astimezone(utc)
+
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+
+    return value
+
+
+def build_owner(user):
+    """
+    对象Owner信息, 一个请求构建一次，通过序列化器context={'owner': owner}传入
+
+    :param user: 用户对象
+    :return:
+        {'ID': user.id, "DisplayName": user.username} or {}
+    """
+    if user:
+        return {'ID': user.id, "DisplayName": user.username}
+
+    return {}
+
+
 class BucketListSerializer(serializers.Serializer):
     """
     桶列表序列化器
@@ -25,7 +68,7 @@ class BucketListSerializer(serializers.Serializer):
 
     @staticmethod
     def get_creation_date(obj):
-        return serializers.DateTimeField(default_timezone=utc).to_representation(obj.created_time)
+        return _ISO_FIELD.to_representation(obj.created_time)
 
     @staticmethod
     def get_name(obj):
@@ -35,53 +78,46 @@ class BucketListSerializer(serializers.Serializer):
 class ObjectListSerializer(serializers.Serializer):
     """
     对象序列化器
-    """
-    Key = serializers.SerializerMethodField(method_name='get_key')
-    LastModified = serializers.SerializerMethodField(method_name='get_last_modified')
-    ETag = serializers.SerializerMethodField(method_name='get_etag')
-    Size = serializers.SerializerMethodField(method_name='get_size')
-    StorageClass = serializers.SerializerMethodField(method_name='get_storage_class')
 
-    @staticmethod
-    def get_key(obj):
-        if obj.is_dir():
-            return obj.na + '/'
-        return obj.na
-
-    @staticmethod
-    def get_last_modified(obj):
+    列举对象的热点路径，直接构建字典，不走逐字段SerializerMethodField
+    """
+    def to_representation(self, obj):
+        fod = obj.fod
         t = obj.upt if obj.upt else obj.ult
-        return serializers.DateTimeField(default_timezone=utc).to_representation(t)
+        return OrderedDict((
+            ('Key', obj.na if fod else obj.na + '/'),
+            ('LastModified', time_to_iso_utc(t)),
+            ('ETag', obj.hex_md5),
+            ('Size', obj.si),
+            ('StorageClass', 'STANDARD')
+        ))
 
-    @staticmethod
-    def get_etag(obj):
-        return obj.hex_md5
-
-    @staticmethod
-    def get_size(obj):
-        return obj.si
+    def iter_representation(self, instances):
+        """
+        逐个生成对象的序列化数据，不构建整个列表，渲染器输出xml时边序列化边写入
 
-    @staticmethod
-    def get_storage_class(obj):
-        return 'STANDARD'
+        :param instances: 对象列表
+        :return: generator
+        """
+        for obj in instances:
+            yield self.to_representation(obj)
 
 
 class ObjectListWithOwnerSerializer(ObjectListSerializer):
     """
     带owner信息的对象序列化器
     """
-    Owner = serializers.SerializerMethodField(method_name='get_owner')
+    def to_representation(self, obj):
+        data = super().to_representation(obj)
+        data['Owner'] = self.get_owner(obj)
+        return data
 
     def get_owner(self, obj):
         owner = self.context.get('owner', None)
         if owner is not None:
             return owner
 
-        user = self.context.get('user', None)
-        owner = {}
-        if user:
-            owner = {'ID': user.id, "DisplayName": user.username}
-
+        owner = build_owner(self.context.get('user', None))
         self.context['owner'] = owner
         return owner
 
@@ -116,7 +152,7 @@ class ListMultipartUploadsSerializer(serializers.Serializer):
     @staticmethod
     def get_initiated(up):
         t = up.create_time
-        return serializers.DateTimeField(default_timezone=utc).to_representation(t)
+        return _ISO_FIELD.to_representation(t)
 
     @staticmethod
     def get_storage_class(up):
@@ -127,10 +163,6 @@ class ListMultipartUploadsSerializer(serializers.Serializer):
         if owner is not None:
             return owner
 
-        user = self.context.get('user', None)
-        owner = {}
-        if user:
-            owner = {'ID': user.id, "DisplayName": user.username}
-
+        owner = build_owner(self.context.get('user', None))
         self.context['owner'] = owner
         return owner
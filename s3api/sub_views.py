@@ -1,10 +1,11 @@
-import base64
+import hashlib
 import re
 from collections import OrderedDict
+from urllib.parse import quote
+from xml.sax.saxutils import escape as xml_escape
 
 from django.utils.translation import gettext
-from django.http import FileResponse
-from django.utils.http import urlquote
+from django.http import FileResponse, HttpResponse
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.serializers import ValidationError
@@ -12,15 +13,15 @@ from rest_framework.exceptions import UnsupportedMediaType
 from rest_framework.parsers import FileUploadParser
 
 from buckets.models import Bucket
-from utils.storagers import FileUploadToCephHandler, PartUploadToCephHandler, try_close_file
-from utils.md5 import EMPTY_BYTES_MD5, EMPTY_HEX_MD5, FileMD5Handler
+from utils.storagers import PartUploadToCephHandler, try_close_file, get_upload_max_file_size
+from utils.md5 import EMPTY_BYTES_MD5, EMPTY_HEX_MD5, b64_md5_equal
 from utils.oss.pyrados import RadosError, build_harbor_object
 from utils.time import datetime_from_gmt
-from buckets.models import BucketFileBase, get_next_bucket_max_id
+from buckets.models import get_next_bucket_max_id
 from . import renders
 from .viewsets import CustomGenericViewSet
-from .validators import DNSStringValidator, bucket_limit_validator
-from .utils import (get_ceph_poolname_rand, BucketFileManagement, create_table_for_model_class,
+from .validators import DNSStringValidator, bucket_limit_validator, dns_regex
+from .utils import (get_ceph_poolname_rand, BucketFileManagement, create_tables_for_model_classes,
                     delete_table_for_model_class, get_ceph_alias_rand)
 from . import exceptions
 from .harbor import HarborManager
@@ -30,10 +31,46 @@ from .managers import (get_parts_model_class, MultipartUploadManager, ObjectPart
 from .negotiation import CusContentNegotiation
 from . import parsers
 from .models import build_part_rados_key
-from .handlers import MULTIPART_UPLOAD_MAX_SIZE
+from .handlers import MULTIPART_UPLOAD_MAX_SIZE, OBJECT_ACL_CHOICES
 from . import handlers
 
 
+BUCKET_ACL_CHOICES = {
+    'private': Bucket.PRIVATE, 'public-read': Bucket.PUBLIC, 'public-read-write': Bucket.PUBLIC_READWRITE
+}   # 存储桶访问权限x-amz-acl
+_HM = HarborManager()   # 无状态，所有请求共用
+_MUM = MultipartUploadManager()   # 无状态，所有请求共用
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')      # 请求头Range
+_QUOTE_SAFE_RE = re.compile(r'[A-Za-z0-9_.~/-]*')    # quote()不编码的字符
+# ListObjectsV2无匹配结果的xml，和ListObjectsV2XMLRenderer渲染的元素一致
+_LIST_V2_NO_MATCH_XML = '<?xml version="1.0" encoding="utf-8"?>\n<ListBucketResult>' \
+                        '<IsTruncated>false</IsTruncated><Name>{name}</Name><Prefix>{prefix}</Prefix>' \
+                        '<EncodingType>url</EncodingType><MaxKeys>{max_keys}</MaxKeys><KeyCount>0</KeyCount>' \
+                        '{delimiter}</ListBucketResult>'
+
+
+def empty_response(status_code: int = status.HTTP_200_OK):
+    """
+    没有内容的响应，不经过DRF的内容协商和渲染，同DRF渲染空内容时一样不含Content-Type；
+    中间件会修改响应标头，每次新建实例，不能共用
+
+    :return: HttpResponse()
+    """
+    response = HttpResponse(status=status_code)
+    del response['Content-Type']
+    return response
+
+
+def quote_filename(filename: str):
+    """
+    url编码文件名，同urlquote()；只含不需编码字符的文件名(大多数)直接返回
+    """
+    if _QUOTE_SAFE_RE.fullmatch(filename):
+        return filename
+
+    return quote(filename, safe='/')
+
+
 class BucketViewSet(CustomGenericViewSet):
     http_method_names = ['get', 'post', 'put', 'delete', 'head', 'options']
     renderer_classes = [renders.CusXMLRenderer]
@@ -103,7 +140,10 @@ class BucketViewSet(CustomGenericViewSet):
         if not bucket_name:
             return self.exception_response(request, exceptions.S3InvalidRequest('Invalid request domain name'))
 
-        hm = HarborManager()
+        if not dns_regex.match(bucket_name):     # 不可能存在的桶名称，不查询数据库
+            return self.exception_response(request, exceptions.S3NoSuchBucket())
+
+        hm = _HM
         try:
             bucket, qs = hm.get_bucket_objects_dirs_queryset(bucket_name=bucket_name, user=request.user)
         except exceptions.S3Error as e:
@@ -119,24 +159,24 @@ class BucketViewSet(CustomGenericViewSet):
         if not bucket.delete_and_archive():  # 删除归档
             return self.exception_response(request, exceptions.S3InternalError(gettext('删除存储桶失败')))
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return empty_response(status.HTTP_204_NO_CONTENT)
 
     def head_bucket(self, request, *args, **kwargs):
         bucket_name = self.get_bucket_name(request)
         if not bucket_name:
             return self.exception_response(request, exceptions.S3InvalidRequest('Invalid request domain name'))
 
-        bucket = Bucket.get_bucket_by_name(bucket_name)
+        bucket = Bucket.get_bucket_by_name_cached(bucket_name)
         if not bucket:
             return self.exception_response(request, exceptions.S3NoSuchBucket())
 
         if bucket.is_public_permission():
-            return Response(status=status.HTTP_200_OK)
+            return empty_response(status.HTTP_200_OK)
 
         if not bucket.check_user_own_bucket(user=request.user):
             return self.exception_response(request, exceptions.S3AccessDenied())
 
-        return Response(status=status.HTTP_200_OK)
+        return empty_response(status.HTTP_200_OK)
 
     @staticmethod
     def validate_create_bucket(request, bucket_name: str):
@@ -151,11 +191,8 @@ class BucketViewSet(CustomGenericViewSet):
         if not bucket_name:
             raise exceptions.S3BucketNotEmpty()
 
-        if bucket_name.startswith('-') or bucket_name.endswith('-'):
-            raise exceptions.S3InvalidBucketName()      # 存储桶bucket名称不能以“-”开头或结尾
-
         try:
-            DNSStringValidator(bucket_name)
+            DNSStringValidator(bucket_name)     # 存储桶bucket名称不能以“-”开头或结尾
         except ValidationError:
             raise exceptions.S3InvalidBucketName()
 
@@ -167,9 +204,9 @@ class BucketViewSet(CustomGenericViewSet):
         except ValidationError:
             raise exceptions.S3TooManyBuckets()
 
-        b = Bucket.get_bucket_by_name(bucket_name)
+        b = Bucket.objects.filter(name=bucket_name).values('user_id').first()     # 只需要所有者id，不join user表
         if b:
-            if b.check_user_own_bucket(user):
+            if user.id and b['user_id'] == user.id:
                 raise exceptions.S3BucketAlreadyOwnedByYou()
             raise exceptions.S3BucketAlreadyExists()
         return bucket_name
@@ -180,7 +217,7 @@ class BucketViewSet(CustomGenericViewSet):
 
         :return: Response()
         """
-        acl_choices = {'private': Bucket.PRIVATE, 'public-read': Bucket.PUBLIC, 'public-read-write': Bucket.PUBLIC_READWRITE}
+        acl_choices = BUCKET_ACL_CHOICES
         acl = request.headers.get('x-amz-acl', 'private').lower()
         if acl not in acl_choices:
             e = exceptions.S3InvalidRequest('The value of header "x-amz-acl" is invalid and unsupported.')
@@ -212,20 +249,20 @@ class BucketViewSet(CustomGenericViewSet):
         col_name = bucket.get_bucket_table_name()
         bfm = BucketFileManagement(collection_name=col_name)
         model_class = bfm.get_obj_model_class()
-        if not create_table_for_model_class(model=model_class):
-            bucket.delete()
-            delete_table_for_model_class(model=model_class)
-            return self.exception_response(request, exceptions.S3InternalError(
-                message=gettext('创建存储桶失败，存储桶object表错误')))
-
         part_table_name = bucket.get_parts_table_name()
         parts_class = get_parts_model_class(table_name=part_table_name)
-        if not create_table_for_model_class(model=parts_class):
+        # object表和parts表相互独立，并发创建
+        obj_table_ok, parts_table_ok = create_tables_for_model_classes(models=[model_class, parts_class])
+        if not (obj_table_ok and parts_table_ok):
             bucket.delete()
             delete_table_for_model_class(model=parts_class)
             delete_table_for_model_class(model=model_class)
-            return self.exception_response(request, exceptions.S3InternalError(
-                message=gettext('创建存储桶失败，存储桶parts表错误')))
+            if not obj_table_ok:
+                msg = gettext('创建存储桶失败，存储桶object表错误')
+            else:
+                msg = gettext('创建存储桶失败，存储桶parts表错误')
+
+            return self.exception_response(request, exceptions.S3InternalError(message=msg))
 
         return Response(status=status.HTTP_200_OK, headers={'Location': '/' + bucket_name})
 
@@ -246,7 +283,7 @@ class BucketViewSet(CustomGenericViewSet):
         if prefix and not path:     # prefix invalid, return no match data
             return self.list_objects_v2_no_match(request=request, prefix=prefix, delimiter=delimiter)
 
-        hm = HarborManager()
+        hm = _HM
         try:
             bucket, obj = hm.get_bucket_and_obj_or_dir(bucket_name=bucket_name, path=path, user=request.user)
         except exceptions.S3Error as e:
@@ -270,18 +307,26 @@ class BucketViewSet(CustomGenericViewSet):
             if not obj.is_dir():
                 return self.list_objects_v2_no_match(request=request, prefix=prefix, delimiter=delimiter, bucket=bucket)
 
+            # 只探测目录是否存在（max-keys=0），不查询目录下的对象
+            if request.query_params.get('max-keys', None) == '0':
+                ret_data['MaxKeys'] = 0
+                ret_data['KeyCount'] = 0
+                self.set_renderer(request, renders.ListObjectsV2XMLRenderer())
+                return Response(data=ret_data, status=status.HTTP_200_OK)
+
             objs_qs = hm.list_dir_queryset(bucket=bucket, dir_obj=obj)
             paginator.paginate_queryset(objs_qs, request=request)
             objs, _ = paginator.get_objects_and_dirs()
 
             if fetch_owner == 'true':
-                serializer = serializers.ObjectListV2WithOwnerSerializer(objs, many=True, context={'user': request.user})
+                owner = serializers.build_owner(request.user)
+                serializer = serializers.ObjectListV2WithOwnerSerializer(context={'owner': owner})
             else:
-                serializer = serializers.ObjectListV2Serializer(objs, many=True)
+                serializer = serializers.ObjectListV2Serializer()
 
             data = paginator.get_paginated_data(common_prefixes=True, delimiter=delimiter)
             ret_data.update(data)
-            ret_data['Contents'] = serializer.data
+            ret_data['Contents'] = serializer.iter_representation(objs)    # 渲染时逐个序列化
             self.set_renderer(request, renders.ListObjectsV2XMLRenderer())
             return Response(data=ret_data, status=status.HTTP_200_OK)
 
@@ -290,7 +335,8 @@ class BucketViewSet(CustomGenericViewSet):
             return self.list_objects_v2_no_match(request=request, prefix=prefix, delimiter=delimiter, bucket=bucket)
 
         if fetch_owner == 'true':
-            serializer = serializers.ObjectListV2WithOwnerSerializer(obj, context={'user': request.user})
+            owner = serializers.build_owner(request.user)
+            serializer = serializers.ObjectListV2WithOwnerSerializer(obj, context={'owner': owner})
         else:
             serializer = serializers.ObjectListV2Serializer(obj)
 
@@ -306,7 +352,7 @@ class BucketViewSet(CustomGenericViewSet):
         fetch_owner = request.query_params.get('fetch-owner', '').lower()
 
         bucket_name = self.get_bucket_name(request)
-        hm = HarborManager()
+        hm = _HM
         try:
             bucket, objs_qs = hm.get_bucket_objects_dirs_queryset(bucket_name=bucket_name, user=request.user, prefix=prefix)
         except exceptions.S3Error as e:
@@ -315,12 +361,13 @@ class BucketViewSet(CustomGenericViewSet):
         paginator = paginations.ListObjectsV2CursorPagination(context={'bucket': bucket})
         objs_dirs = paginator.paginate_queryset(objs_qs, request=request)
         if fetch_owner == 'true':
-            serializer = serializers.ObjectListV2WithOwnerSerializer(objs_dirs, many=True, context={'user': request.user})
+            owner = serializers.build_owner(request.user)
+            serializer = serializers.ObjectListV2WithOwnerSerializer(context={'owner': owner})
         else:
-            serializer = serializers.ObjectListV2Serializer(objs_dirs, many=True)
+            serializer = serializers.ObjectListV2Serializer()
 
         data = paginator.get_paginated_data()
-        data['Contents'] = serializer.data
+        data['Contents'] = serializer.iter_representation(objs_dirs)     # 渲染时逐个序列化
         data['Name'] = bucket_name
         data['Prefix'] = prefix
         data['EncodingType'] = 'url'
@@ -338,19 +385,12 @@ class BucketViewSet(CustomGenericViewSet):
 
         paginator = paginations.ListObjectsV2CursorPagination(context=context)
         max_keys = paginator.get_page_size(request=request)
-        ret_data = {
-            'IsTruncated': 'false',     # can not use True
-            'Name': bucket_name,
-            'Prefix': prefix,
-            'EncodingType': 'url',
-            'MaxKeys': max_keys,
-            'KeyCount': 0
-        }
-        if delimiter:
-            ret_data['Delimiter'] = delimiter
-
-        self.set_renderer(request, renders.ListObjectsV2XMLRenderer())
-        return Response(data=ret_data, status=status.HTTP_200_OK)
+        delimiter = f'<Delimiter>{xml_escape(delimiter)}</Delimiter>' if delimiter else ''
+        content = _LIST_V2_NO_MATCH_XML.format(name=xml_escape(bucket_name), prefix=xml_escape(prefix),
+                                               max_keys=max_keys, delimiter=delimiter)
+        # 内容固定，不经过DRF的渲染
+        return HttpResponse(content.encode('utf-8'), status=status.HTTP_200_OK,
+                            content_type='application/xml; charset=utf-8')
 
     def list_objects_v1(self, request, *args, **kwargs):
         return handlers.ListObjectsHandler().list_objects(view=self, request=request)
@@ -366,7 +406,7 @@ class BucketViewSet(CustomGenericViewSet):
             return self.exception_response(request, exceptions.S3InvalidArgument(message=gettext('参数“delimiter”暂时不支持')))
 
         try:
-            bucket = HarborManager().get_public_or_user_bucket(name=bucket_name, user=request.user)
+            bucket = _HM.get_public_or_user_bucket(name=bucket_name, user=request.user)
         except exceptions.S3Error as e:
             return self.exception_response(request, e)
 
@@ -377,7 +417,7 @@ class BucketViewSet(CustomGenericViewSet):
             except ValueError:
                 return self.exception_response(request, exceptions.S3AccessDenied())
 
-        queryset = MultipartUploadManager().list_multipart_uploads_queryset(bucket_name=bucket_name, prefix=prefix)
+        queryset = _MUM.list_multipart_uploads_queryset(bucket_name=bucket_name, prefix=prefix)
         paginator = paginations.ListUploadsKeyPagination(context={'bucket': bucket})
 
         ret_data = {
@@ -388,7 +428,8 @@ class BucketViewSet(CustomGenericViewSet):
             ret_data['EncodingType'] = encoding_type
 
         ups = paginator.paginate_queryset(queryset, request=request)
-        serializer = serializers.ListMultipartUploadsSerializer(ups, many=True, context={'user': request.user})
+        owner = serializers.build_owner(request.user)
+        serializer = serializers.ListMultipartUploadsSerializer(ups, many=True, context={'owner': owner})
         data = paginator.get_paginated_data()
         ret_data.update(data)
         ret_data['Upload'] = serializer.data
@@ -398,15 +439,17 @@ class BucketViewSet(CustomGenericViewSet):
     def delete_objects(self, request):
         bucket_name = self.get_bucket_name(request)
 
-        body = request.body
         content_b64_md5 = self.request.headers.get('Content-MD5', '')
-        md5_hl = FileMD5Handler()
-        md5_hl.update(offset=0, data=body)
-        bytes_md5 = md5_hl.digest()
-        base64_md5 = base64.b64encode(bytes_md5).decode('ascii')
-        if content_b64_md5 != base64_md5:
+        if not content_b64_md5:
             return self.exception_response(request, exceptions.S3BadDigest())
 
+        bytes_md5 = hashlib.md5(request.body).digest()      # body大小受DATA_UPLOAD_MAX_MEMORY_SIZE限制
+        try:
+            if not b64_md5_equal(content_b64_md5, bytes_md5):
+                return self.exception_response(request, exceptions.S3BadDigest())
+        except ValueError:
+            return self.exception_response(request, exceptions.S3InvalidDigest())
+
         try:
             data = request.data
         except Exception as e:
@@ -428,7 +471,7 @@ class BucketViewSet(CustomGenericViewSet):
             return self.exception_response(request, exceptions.S3MalformedXML(
                 message='You have attempted to delete more objects than allowed 1000'))
 
-        deleted_objs, err_objs = HarborManager().delete_objects(bucket_name=bucket_name, obj_keys=keys, user=request.user)
+        deleted_objs, err_objs = _HM.delete_objects(bucket_name=bucket_name, obj_keys=keys, user=request.user)
 
         quiet = root.get('Quiet', 'false').lower()
         if quiet == 'true':     # 安静模式不包含 删除成功对象信息
@@ -586,7 +629,7 @@ class ObjViewSet(CustomGenericViewSet):
             return self.exception_response(request, exceptions.S3InvalidRequest())
 
         # 存储桶验证和获取桶对象
-        hm = HarborManager()
+        hm = _HM
         try:
             bucket, fileobj = hm.get_bucket_and_obj_or_dir(bucket_name=bucket_name, path=obj_path_name,
                                                            user=request.user, all_public=True)
@@ -613,23 +656,26 @@ class ObjViewSet(CustomGenericViewSet):
         except exceptions.S3Error as e:
             return self.exception_response(request, e)
 
+        extra_headers = self.get_object_override_headers(request)
         if is_dir:
             if part_number is not None and part_number != '1':
                 return self.exception_response(request,
                                                exceptions.S3InvalidArgument(message=gettext('无效的参数partNumber.')))
 
-            response = self.s3_get_object_dir(fileobj)
+            response = self.s3_get_object_dir(fileobj, extra_headers=extra_headers)
         elif part_number is not None:
             try:
                 part_number = int(part_number)
-                response = self.s3_get_object_part_response(bucket=bucket, obj=fileobj, part_number=part_number)
+                response = self.s3_get_object_part_response(bucket=bucket, obj=fileobj, part_number=part_number,
+                                                            extra_headers=extra_headers)
             except ValueError:
                 return self.exception_response(request, exceptions.S3InvalidArgument(message=gettext('无效的参数partNumber.')))
             except exceptions.S3Error as e:
                 return self.exception_response(request, e)
         else:
             try:
-                response = self.s3_get_object_range_or_whole_response(request=request, bucket=bucket, obj=fileobj)
+                response = self.s3_get_object_range_or_whole_response(request=request, bucket=bucket, obj=fileobj,
+                                                                      extra_headers=extra_headers)
             except exceptions.S3Error as e:
                 return self.exception_response(request, e)
 
@@ -640,23 +686,32 @@ class ObjViewSet(CustomGenericViewSet):
         except exceptions.S3Error as e:
             return self.exception_response(request, e)
 
+        return response
+
+    @staticmethod
+    def get_object_override_headers(request):
+        """
+        用户通过参数设置的要覆盖的响应标头
+
+        :return: dict
+        """
+        headers = {}
         # 用户设置的参数覆盖
         response_content_disposition = request.query_params.get('response-content-disposition', None)
         response_content_type = request.query_params.get('response-content-type', None)
         response_content_encoding = request.query_params.get('response-content-encoding', None)
         response_content_language = request.query_params.get('response-content-language', None)
         if response_content_disposition:
-            response['Content-Disposition'] = response_content_disposition
+            headers['Content-Disposition'] = response_content_disposition
         if response_content_encoding:
-            response['Content-Encoding'] = response_content_encoding
+            headers['Content-Encoding'] = response_content_encoding
         if response_content_language:
-            response['Content-Language'] = response_content_language
+            headers['Content-Language'] = response_content_language
         if response_content_type:
-            response['Content-Type'] = response_content_type
+            headers['Content-Type'] = response_content_type
 
-        response['x-amz-storage-class'] = 'STANDARD'
-
-        return response
+        headers['x-amz-storage-class'] = 'STANDARD'
+        return headers
 
     @staticmethod
     def get_object_part(bucket, obj_id: int, part_number: int):
@@ -682,106 +737,122 @@ class ObjViewSet(CustomGenericViewSet):
 
         raise exceptions.S3InvalidPartNumber()
 
-    def s3_get_object_part_response(self, bucket, obj, part_number: int):
+    def s3_get_object_part_response(self, bucket, obj, part_number: int, extra_headers: dict = None):
         """
         读取对象一个part的响应
 
+        :param extra_headers: 覆盖的响应标头
         :return:
             Response()
 
         :raises: S3Error
         """
         obj_size = obj.si
+        headers = self._get_object_base_headers(obj)
         part = self.get_object_part(bucket=bucket, obj_id=obj.id, part_number=part_number)
         if part:
             offset = part.obj_offset
             size = part.size
             end = offset + size - 1
-            generator = HarborManager()._get_obj_generator(bucket=bucket, obj=obj, offset=offset, end=end)
-            response = FileResponse(generator, status=status.HTTP_206_PARTIAL_CONTENT)
-            response['Content-Length'] = end - offset + 1
-            response['ETag'] = part.obj_etag
-            response['x-amz-mp-parts-count'] = part.parts_count
-            response['Content-Range'] = f'bytes {offset}-{end}/{obj_size}'
+            generator = _HM._get_obj_generator(bucket=bucket, obj=obj, offset=offset, end=end)
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers['Content-Length'] = end - offset + 1
+            headers['ETag'] = part.obj_etag
+            headers['x-amz-mp-parts-count'] = part.parts_count
+            headers['Content-Range'] = f'bytes {offset}-{end}/{obj_size}'
         else:   # 非多部分对象
-            generator = HarborManager()._get_obj_generator(bucket=bucket, obj=obj)
-            response = FileResponse(generator)
-            response['Content-Length'] = obj_size
-            response['ETag'] = obj.md5
+            generator = _HM._get_obj_generator(bucket=bucket, obj=obj)
+            status_code = status.HTTP_200_OK
+            headers['Content-Length'] = obj_size
+            headers['ETag'] = obj.md5
             if obj_size > 0:
                 end = max(obj_size - 1, 0)
-                response['Content-Range'] = f'bytes {0}-{end}/{obj_size}'
+                headers['Content-Range'] = f'bytes {0}-{end}/{obj_size}'
 
-        last_modified = obj.upt if obj.upt else obj.ult
-        filename = urlquote(obj.name)  # 中文文件名需要
-        response['Last-Modified'] = serializers.time_to_gmt(last_modified)
-        response['Accept-Ranges'] = 'bytes'  # 接受类型，支持断点续传
-        response['Content-Type'] = 'binary/octet-stream'  # 注意格式
-        response['Content-Disposition'] = f"attachment;filename*=utf-8''{filename}"  # 注意filename 这个是下载后的名字
+        if extra_headers:
+            headers.update(extra_headers)
 
-        return response
+        return FileResponse(generator, status=status_code, headers=headers)
 
-    def s3_get_object_range_or_whole_response(self, request, bucket, obj):
+    @staticmethod
+    def _get_object_base_headers(obj):
+        """
+        下载对象响应的基本标头
+
+        :return: dict
+        """
+        last_modified = obj.upt if obj.upt else obj.ult
+        filename = quote_filename(obj.name)  # 中文文件名需要
+        return {
+            'Last-Modified': serializers.time_to_gmt(last_modified),
+            'Accept-Ranges': 'bytes',   # 接受类型，支持断点续传
+            'Content-Type': 'binary/octet-stream',  # 注意格式
+            'Content-Disposition': f"attachment;filename*=utf-8''{filename}"    # 注意filename 这个是下载后的名字
+        }
+
+    def s3_get_object_range_or_whole_response(self, request, bucket, obj, extra_headers: dict = None):
         """
         读取对象指定范围或整个对象
 
+        :param extra_headers: 覆盖的响应标头
         :return:
             Response()
 
         :raises: S3Error
         """
         obj_size = obj.si
-        filename = obj.name
-        hm = HarborManager()
+        hm = _HM
+        headers = self._get_object_base_headers(obj)
         ranges = request.headers.get('range', None)
         if ranges is not None:  # 是否是断点续传部分读取
             offset, end = self.get_object_offset_and_end(ranges, filesize=obj_size)
 
             generator = hm._get_obj_generator(bucket=bucket, obj=obj, offset=offset, end=end)
-            response = FileResponse(generator, status=status.HTTP_206_PARTIAL_CONTENT)
-            response['Content-Range'] = f'bytes {offset}-{end}/{obj_size}'
-            response['Content-Length'] = end - offset + 1
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers['Content-Range'] = f'bytes {offset}-{end}/{obj_size}'
+            headers['Content-Length'] = end - offset + 1
         else:
             generator = hm._get_obj_generator(bucket=bucket, obj=obj)
-            response = FileResponse(generator)
-            response['Content-Length'] = obj_size
+            status_code = status.HTTP_200_OK
+            headers['Content-Length'] = obj_size
 
             # 增加一次下载次数
             obj.download_cound_increase()
 
         # multipart object check
-        parts_qs = ObjectPartManager(bucket=bucket).get_parts_queryset_by_obj_id(obj_id=obj.id)
-        part = parts_qs.first()
+        part = ObjectPartManager(bucket=bucket).get_obj_etag_part(obj_id=obj.id)
         if part:        #
-            response['ETag'] = part.obj_etag
-            response['x-amz-mp-parts-count'] = part.parts_count
+            headers['ETag'] = part.obj_etag
+            headers['x-amz-mp-parts-count'] = part.parts_count
         else:
-            response['ETag'] = obj.md5
+            headers['ETag'] = obj.md5
 
-        last_modified = obj.upt if obj.upt else obj.ult
-        filename = urlquote(filename)  # 中文文件名需要
+        if extra_headers:
+            headers.update(extra_headers)
 
-        response['Last-Modified'] = serializers.time_to_gmt(last_modified)
-        response['Accept-Ranges'] = 'bytes'  # 接受类型，支持断点续传
-        response['Content-Type'] = 'binary/octet-stream'  # 注意格式
-        response['Content-Disposition'] = f"attachment;filename*=utf-8''{filename}"  # 注意filename 这个是下载后的名字
-        return response
+        return FileResponse(generator, status=status_code, headers=headers)
 
     @staticmethod
-    def s3_get_object_dir(obj):
+    def s3_get_object_dir(obj, extra_headers: dict = None):
         """
         获取的是一个目录
+
+        :param extra_headers: 覆盖的响应标头
         :return:
             Response()
         """
         last_modified = obj.upt if obj.upt else obj.ult
-        response = FileResponse(b'')
-        response['Content-Length'] = 0
-        response['ETag'] = f'"{EMPTY_HEX_MD5}"'
-        response['Last-Modified'] = serializers.time_to_gmt(last_modified)
-        response['Accept-Ranges'] = 'bytes'  # 接受类型，支持断点续传
-        response['Content-Type'] = 'application/x-directory; charset=UTF-8'  # 注意格式, dir
-        return response
+        headers = {
+            'Content-Length': 0,
+            'ETag': f'"{EMPTY_HEX_MD5}"',
+            'Last-Modified': serializers.time_to_gmt(last_modified),
+            'Accept-Ranges': 'bytes',   # 接受类型，支持断点续传
+            'Content-Type': 'application/x-directory; charset=UTF-8'    # 注意格式, dir
+        }
+        if extra_headers:
+            headers.update(extra_headers)
+
+        return FileResponse(b'', headers=headers)
 
     def get_object_offset_and_end(self, h_range: str, filesize: int):
         """
@@ -795,26 +866,17 @@ class ObjViewSet(CustomGenericViewSet):
         :raise S3Error
         """
         start, end = self.parse_header_range(h_range)
-        if start is None and end is None:
-            raise exceptions.S3InvalidRange()
-
-        if isinstance(start, int):
-            if start >= filesize or start < 0:
+        end_max = filesize - 1
+        if start is None:
+            if end is None:
                 raise exceptions.S3InvalidRange()
 
-        end_max = filesize - 1
-        # 读最后end个字节
-        if (start is None) and isinstance(end, int):
-            offset = max(filesize - end, 0)
-            end = end_max
-        else:
-            offset = start
-            if isinstance(end, int):
-                end = min(end, end_max)
-            else:
-                end = end_max
+            return max(filesize - end, 0), end_max  # 读最后end个字节
 
-        return offset, end
+        if start >= filesize or start < 0:
+            raise exceptions.S3InvalidRange()
+
+        return start, (end_max if end is None else min(end, end_max))
 
     @staticmethod
     def parse_header_range(h_range: str):
@@ -826,14 +888,20 @@ class ObjViewSet(CustomGenericViewSet):
             start: int or None
             end: int or None
         """
-        m = re.match(r'bytes=(\d*)-(\d*)', h_range)
-        if not m:
+        if not h_range.startswith('bytes='):
             return None, None
-        items = m.groups()
 
-        start = int(items[0]) if items[0] else None
-        end = int(items[1]) if items[1] else None
-        if isinstance(start, int) and isinstance(end, int) and start > end:
+        start_s, sep, end_s = h_range[6:].partition('-')
+        if not sep or (start_s and not start_s.isdecimal()) or (end_s and not end_s.isdecimal()):
+            m = _RANGE_RE.match(h_range)    # 不常见的格式（如多个范围）才使用正则
+            if not m:
+                return None, None
+
+            start_s, end_s = m.group(1), m.group(2)
+
+        start = int(start_s) if start_s else None
+        end = int(end_s) if end_s else None
+        if start is not None and end is not None and start > end:
             return None, None
         return start, end
 
@@ -873,18 +941,22 @@ class ObjViewSet(CustomGenericViewSet):
 
         return True
 
-    def create_object_metadata(self, request):
+    def create_object_metadata(self, request, x_amz_acl: str = None):
+        """
+        :param x_amz_acl: 请求头x-amz-acl的值，None时从请求头读取
+        """
         bucket_name = self.get_bucket_name(request)
         obj_path_name = self.get_obj_path_name(request)
 
         # 访问权限
-        acl_choices = {'private': BucketFileBase.SHARE_ACCESS_NO, 'public-read': BucketFileBase.SHARE_ACCESS_READONLY,
-                       'public-read-write': BucketFileBase.SHARE_ACCESS_READWRITE}
-        x_amz_acl = request.headers.get('X-Amz-Acl', 'private').lower()
+        acl_choices = OBJECT_ACL_CHOICES
+        if x_amz_acl is None:
+            x_amz_acl = request.headers.get('X-Amz-Acl', None)
+        x_amz_acl = (x_amz_acl or 'private').lower()
         if x_amz_acl not in acl_choices:
             raise exceptions.S3InvalidRequest(f'The value {x_amz_acl} of header "x-amz-acl" is not supported.')
 
-        h_manager = HarborManager()
+        h_manager = _HM
         bucket, obj, created = h_manager.create_empty_obj(bucket_name=bucket_name, obj_path=obj_path_name,
                                                           user=request.user)
 
@@ -911,90 +983,113 @@ class ObjViewSet(CustomGenericViewSet):
         return self.put_object(request=request, args=args, kwargs=kwargs)
 
     def put_object(self, request, args, kwargs):
+        x_amz_acl = request.headers.get('X-Amz-Acl', None)
         try:
-            bucket, obj, rados, created = self.create_object_metadata(request=request)
+            bucket, obj, rados, created = self.create_object_metadata(request=request, x_amz_acl=x_amz_acl)
         except exceptions.S3Error as e:
             return self.exception_response(request, e)
 
-        return self.put_object_handle(request=request, bucket=bucket, obj=obj, rados=rados, created=created)
+        return self.put_object_handle(request=request, bucket=bucket, obj=obj, rados=rados, created=created,
+                                      x_amz_acl=x_amz_acl)
 
-    def put_object_handle(self, request, bucket, obj, rados, created):
-        pool_name = bucket.get_pool_name()
-        obj_key = obj.get_obj_key(bucket.id)
-        uploader = FileUploadToCephHandler(using=bucket.ceph_using, request=request,
-                                           pool_name=pool_name, obj_key=obj_key)
-        request.upload_handlers = [uploader]
+    PUT_OBJECT_READ_CHUNK_SIZE = 4 * 1024 ** 2     # 4MB
+    PUT_OBJECT_MAX_IN_FLIGHT = 4                    # 上传对象时最多同时进行的ceph异步写操作数
 
-        def clean_put(_uploader, _obj, _created):
-            # 删除数据和元数据
-            f = getattr(_uploader, 'file', None)
-            if f is not None:
-                try_close_file(f)
+    def put_object_handle(self, request, bucket, obj, rados, created, x_amz_acl: str = None):
+        """
+        上传对象数据，直接从请求体流中按块读取并写入ceph，同时增量计算MD5
 
-            s = f.size if f else 0
+        :param x_amz_acl: 请求头x-amz-acl的值，回复头中原样返回
+        """
+        def clean_put(_obj, _created, _size):
+            # 删除数据和元数据
             try:
-                rados.delete(obj_size=s)
+                rados.delete(obj_size=_size)
             except Exception:
                 pass
             if _created:
                 _obj.do_delete()
 
+        content_length = self.request.headers.get('Content-Length', None)
         try:
-            self.kwargs['filename'] = 'filename'
-            put_data = request.data
-        except UnsupportedMediaType:
-            clean_put(uploader, obj, created)
-            return self.exception_response(request, exceptions.S3UnsupportedMediaType())
-        except RadosError as e:
-            clean_put(uploader, obj, created)
-            return self.exception_response(request, exceptions.S3InternalError(extend_msg=str(e)))
-        except Exception as exc:
-            clean_put(uploader, obj, created)
-            return self.exception_response(request, exceptions.S3InvalidRequest(extend_msg=str(exc)))
-
-        file = put_data.get('file')
-        if not file:
-            content_length = self.request.headers.get('Content-Length', None)
-            try:
-                content_length = int(content_length)
-            except Exception:
-                clean_put(uploader, obj, created)
-                return self.exception_response(request, exceptions.S3MissingContentLength())
+            content_length = int(content_length)
+            if content_length < 0:
+                raise ValueError
+        except Exception:
+            clean_put(obj, created, 0)
+            return self.exception_response(request, exceptions.S3MissingContentLength())
 
-            # 是否是空对象
-            if content_length != 0:
-                clean_put(uploader, obj, created)
-                return self.exception_response(request, exceptions.S3InvalidRequest('Request body is empty.'))
+        max_size = get_upload_max_file_size()
+        if max_size is not None and content_length > max_size:
+            clean_put(obj, created, 0)
+            return self.exception_response(request, exceptions.S3EntityTooLarge())
 
+        obj_size = 0
+        if content_length == 0:     # 空对象
             bytes_md5 = EMPTY_BYTES_MD5
             obj_md5 = EMPTY_HEX_MD5
-            obj_size = 0
         else:
-            bytes_md5 = file.md5_handler.digest()
-            obj_md5 = file.file_md5
-            obj_size = file.size
+            md5_hash = hashlib.md5()
+            read_state = {'size': 0, 'error': None}
+
+            def read_chunks(stream, chunk_size):
+                # 从请求体流中按块读取，同时增量计算MD5
+                while read_state['size'] < content_length:
+                    try:
+                        chunk = stream.read(min(chunk_size, content_length - read_state['size']))
+                    except Exception as exc:
+                        read_state['error'] = exc
+                        return
+
+                    if not chunk:
+                        return
+
+                    md5_hash.update(chunk)
+                    read_state['size'] += len(chunk)
+                    yield chunk
+
+            # 异步流水线写入ceph，读取下一块数据时上一块的写入仍在进行
+            ok, msg = rados.write_chunks(chunks=read_chunks(request.stream, self.PUT_OBJECT_READ_CHUNK_SIZE),
+                                         offset=0, max_in_flight=self.PUT_OBJECT_MAX_IN_FLIGHT)
+            obj_size = read_state['size']
+            if read_state['error'] is not None:
+                clean_put(obj, created, obj_size)
+                return self.exception_response(request, exceptions.S3InvalidRequest(
+                    extend_msg=str(read_state['error'])))
+            if not ok:
+                clean_put(obj, created, obj_size)
+                return self.exception_response(request, exceptions.S3InternalError(extend_msg=msg))
+
+            if obj_size != content_length:
+                clean_put(obj, created, obj_size)
+                return self.exception_response(request, exceptions.S3IncompleteBody())
+
+            bytes_md5 = md5_hash.digest()
+            obj_md5 = md5_hash.hexdigest()
 
         content_b64_md5 = self.request.headers.get('Content-MD5', '')
         if content_b64_md5:
-            base64_md5 = base64.b64encode(bytes_md5).decode('ascii')
-            if content_b64_md5 != base64_md5:
+            try:
+                md5_ok = b64_md5_equal(content_b64_md5, bytes_md5)
+            except ValueError:
+                clean_put(obj, created, obj_size)
+                return self.exception_response(request, exceptions.S3InvalidDigest())
+
+            if not md5_ok:
                 # 删除数据和元数据
-                clean_put(uploader, obj, created)
+                clean_put(obj, created, obj_size)
                 return self.exception_response(request, exceptions.S3BadDigest())
 
         try:
             obj.si = obj_size
             obj.md5 = obj_md5
-            obj.save(update_fields=['si', 'md5'])
+            type(obj).objects.filter(pk=obj.pk).update(si=obj_size, md5=obj_md5)   # 不经过save()的信号等处理
         except Exception as e:
             # 删除数据和元数据
-            clean_put(uploader, obj, created)
+            clean_put(obj, created, obj_size)
             return self.exception_response(request, exceptions.S3InternalError('更新对象元数据错误'))
 
-        try_close_file(file)
-
         headers = {'ETag': obj_md5}
-        x_amz_acl = request.headers.get('x-amz-acl', None)
         if x_amz_acl:
             headers['X-Amz-Acl'] = x_amz_acl
         return Response(status=status.HTTP_200_OK, headers=headers)
@@ -1002,13 +1097,13 @@ class ObjViewSet(CustomGenericViewSet):
     def delete_object(self, request, args, kwargs):
         bucket_name = self.get_bucket_name(request)
         obj_path_name = self.get_obj_path_name(request)
-        h_manager = HarborManager()
+        h_manager = _HM
         try:
             h_manager.delete_object(bucket_name=bucket_name, obj_path=obj_path_name, user=request.user)
         except exceptions.S3Error as e:
             return self.exception_response(request, e)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return empty_response(status.HTTP_204_NO_CONTENT)
 
     def create_dir(self, request, args, kwargs):
         bucket_name = self.get_bucket_name(request)
@@ -1029,7 +1124,7 @@ class ObjViewSet(CustomGenericViewSet):
         if content_length != 0:
             return self.exception_response(request, exceptions.S3InvalidContentLength())
 
-        hm = HarborManager()
+        hm = _HM
         bucket = hm.get_user_own_bucket(name=bucket_name, user=request.user)
         if not bucket:
             return self.exception_response(request, exceptions.S3NoSuchBucket())
@@ -1049,19 +1144,22 @@ class ObjViewSet(CustomGenericViewSet):
             return self.exception_response(request, exceptions.S3InvalidSuchKey())
 
         try:
-            HarborManager().rmdir(bucket_name=bucket_name, dirpath=dir_path_name, user=request.user)
+            _HM.rmdir(bucket_name=bucket_name, dirpath=dir_path_name, user=request.user)
         except exceptions.S3Error as e:
             return self.exception_response(request, e)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return empty_response(status.HTTP_204_NO_CONTENT)
 
     def get_parsers(self):
         """
         动态分配请求体解析器
         """
         method = self.request.method.lower()
-        if method == 'put':                     # put_object
-            return [FileUploadParser()]
+        if method == 'put':
+            # 只有UploadPart通过request.data解析请求体；PutObject直接从request.stream读取，不访问request.data
+            params = self.request.GET     # initialize_request()时self.request还是django的HttpRequest
+            if 'partNumber' in params and 'uploadId' in params:
+                return [FileUploadParser()]
 
         return super().get_parsers()
 
@@ -1076,13 +1174,12 @@ class ObjViewSet(CustomGenericViewSet):
                 return self.exception_response(request, exceptions.S3InvalidArgument("Expires is invalid GMT datetime"))
 
         # 访问权限
-        acl_choices = {'private': BucketFileBase.SHARE_ACCESS_NO, 'public-read': BucketFileBase.SHARE_ACCESS_READONLY,
-                       'public-read-write': BucketFileBase.SHARE_ACCESS_READWRITE}
+        acl_choices = OBJECT_ACL_CHOICES
         x_amz_acl = request.headers.get('X-Amz-Acl', 'private').lower()
         if x_amz_acl not in acl_choices:
             raise exceptions.S3InvalidRequest(f'The value {x_amz_acl} of header "x-amz-acl" is not supported.')
 
-        h_manager = HarborManager()
+        h_manager = _HM
         try:
             bucket = h_manager.get_public_or_user_bucket(name=bucket_name, user=request.user)
         except exceptions.S3Error as e:
@@ -1091,7 +1188,7 @@ class ObjViewSet(CustomGenericViewSet):
         if not bucket.is_s3_bucket():
             return self.exception_response(request, exceptions.S3NotS3Bucket())
 
-        mu_mgr = MultipartUploadManager()
+        mu_mgr = _MUM
         try:
             upload = mu_mgr.get_multipart_upload_delete_invalid(bucket=bucket, obj_path=obj_path_name)
             if upload and upload.is_composing():   # 正在组合对象，不允许操作
@@ -1249,7 +1346,7 @@ class ObjViewSet(CustomGenericViewSet):
         """
         obj_path_name = self.get_s3_obj_key(request)
 
-        mu_mgr = MultipartUploadManager()
+        mu_mgr = _MUM
         upload = mu_mgr.get_multipart_upload_by_id(upload_id=upload_id)
 
         if not upload:
@@ -1258,7 +1355,7 @@ class ObjViewSet(CustomGenericViewSet):
         if upload.obj_key != obj_path_name:
             raise exceptions.S3NoSuchUpload(f'UploadId conflicts with this object key.Please Key "{upload.obj_key}"')
 
-        hm = HarborManager()
+        hm = _HM
         bucket = hm.get_user_own_bucket(name=bucket_name, user=request.user)
         if not bucket:
             raise exceptions.S3NoSuchBucket()
@@ -1358,7 +1455,7 @@ class ObjViewSet(CustomGenericViewSet):
             return self.exception_response(request, exceptions.S3InvalidRequest())
 
         # 存储桶验证和获取桶对象
-        hm = HarborManager()
+        hm = _HM
         try:
             bucket, fileobj = hm.get_bucket_and_obj(bucket_name=bucket_name, obj_path=obj_path_name,
                                                     user=request.user, all_public=True)
@@ -1418,8 +1515,7 @@ class ObjViewSet(CustomGenericViewSet):
         :raises: S3Error
         """
         # multipart object check
-        parts_qs = ObjectPartManager(bucket=bucket).get_parts_queryset_by_obj_id(obj_id=obj.id)
-        part = parts_qs.first()
+        part = ObjectPartManager(bucket=bucket).get_obj_etag_part(obj_id=obj.id)
         headers = self.head_object_common_headers(obj=obj, part=part)
 
         return Response(status=status.HTTP_200_OK, headers=headers)
@@ -1461,8 +1557,7 @@ class ObjViewSet(CustomGenericViewSet):
             offset, end = self.get_object_offset_and_end(header_range, filesize=obj_size)
 
             # multipart object check
-            parts_qs = ObjectPartManager(bucket=bucket).get_parts_queryset_by_obj_id(obj_id=obj.id)
-            part = parts_qs.first()
+            part = ObjectPartManager(bucket=bucket).get_obj_etag_part(obj_id=obj.id)
             if part:
                 response['ETag'] = part.obj_etag
                 response['x-amz-mp-parts-count'] = part.parts_count
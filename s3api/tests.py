@@ -0,0 +1,315 @@
+import io
+import binascii
+from base64 import b64encode
+from types import SimpleNamespace
+from unittest import mock
+
+from django.db.models import F
+from django.test import SimpleTestCase, override_settings
+from rest_framework.pagination import Cursor
+
+from utils.counters import DelayedIncrementer
+from . import exceptions
+from .harbor import HarborManager
+from .paginations import ListObjectsV2CursorPagination, encode_cursor_token
+from .sub_views import ObjViewSet
+
+
+class ListObjectsV2TokenTests(SimpleTestCase):
+    """
+    ListObjectsV2 continuation-token编码解码
+    """
+    def test_round_trip(self):
+        for position in (1, 123, 2 ** 63 - 1):
+            token = ListObjectsV2CursorPagination.encode_token(position)
+            self.assertEqual(ListObjectsV2CursorPagination.decode_token(token), position)
+
+    def test_legacy_cursor_token(self):
+        # 之前CursorPagination格式的token
+        token = encode_cursor_token(Cursor(offset=0, reverse=False, position='123'))
+        self.assertEqual(ListObjectsV2CursorPagination.decode_token(token), 123)
+
+        token = b64encode(b'p=456').decode('ascii')
+        self.assertEqual(ListObjectsV2CursorPagination.decode_token(token), 456)
+
+    def test_legacy_token_without_position(self):
+        token = b64encode(b'o=2').decode('ascii')
+        self.assertIsNone(ListObjectsV2CursorPagination.decode_token(token))
+
+    def test_invalid_token(self):
+        for token in ('not-a-token!', b64encode(b'p=abc').decode('ascii')):
+            with self.assertRaises((ValueError, TypeError, binascii.Error)):
+                ListObjectsV2CursorPagination.decode_token(token)
+
+
+class DelayedIncrementerTests(SimpleTestCase):
+    """
+    下载次数延迟批量累加
+    """
+    def setUp(self):
+        patcher = mock.patch('utils.counters.threading.Thread')
+        self.thread_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def build_model(name='Obj'):
+        model = mock.MagicMock()
+        model.__name__ = name
+        return model
+
+    def test_increase_merges_same_row(self):
+        inc = DelayedIncrementer(field_name='dlc')
+        model = self.build_model()
+        inc.increase(model=model, pk=1)
+        inc.increase(model=model, pk=1, n=2)
+        inc.increase(model=model, pk=2)
+        self.assertEqual(inc._pending, {(model, 1): 3, (model, 2): 1})
+        self.thread_cls.return_value.start.assert_called_once()
+
+    @mock.patch('utils.counters.close_old_connections')
+    def test_flush_updates_with_f_expression(self, _):
+        inc = DelayedIncrementer(field_name='dlc')
+        model = self.build_model()
+        inc.increase(model=model, pk=1, n=3)
+        inc.flush()
+
+        model.objects.filter.assert_called_once_with(pk=1)
+        model.objects.filter.return_value.update.assert_called_once_with(dlc=F('dlc') + 3)
+        self.assertEqual(inc._pending, {})
+
+        inc.flush()     # 没有累积的计数，不更新
+        model.objects.filter.assert_called_once()
+
+    @mock.patch('utils.counters.close_old_connections')
+    def test_flush_continues_after_row_error(self, _):
+        inc = DelayedIncrementer(field_name='dlc')
+        bad = self.build_model('Bad')
+        bad.objects.filter.return_value.update.side_effect = Exception('db error')
+        good = self.build_model('Good')
+        inc.increase(model=bad, pk=1)
+        inc.increase(model=good, pk=2)
+        inc.flush()
+
+        good.objects.filter.return_value.update.assert_called_once_with(dlc=F('dlc') + 1)
+        self.assertEqual(inc._pending, {})
+
+    def test_fork_resets_pending(self):
+        inc = DelayedIncrementer(field_name='dlc')
+        model = self.build_model()
+        inc.increase(model=model, pk=1, n=5)
+        self.assertEqual(self.thread_cls.return_value.start.call_count, 1)
+
+        inc._pid = -1       # 模拟fork后的子进程
+        inc.increase(model=model, pk=2)
+        self.assertEqual(inc._pending, {(model, 2): 1})
+        self.assertEqual(self.thread_cls.return_value.start.call_count, 2)
+
+
+class FakeObjectQuerySet:
+    """
+    模拟对象元数据表的QuerySet，只支持keyset分页用到的方法
+    """
+    def __init__(self, rows, order_by=()):
+        self.rows = rows
+        self.query = SimpleNamespace(order_by=order_by)
+
+    def filter(self, id__lt):
+        return FakeObjectQuerySet([r for r in self.rows if r[0] < id__lt], order_by=self.query.order_by)
+
+    def order_by(self, *fields):
+        assert fields == ('-id',)
+        return FakeObjectQuerySet(sorted(self.rows, key=lambda r: r[0], reverse=True), order_by=fields)
+
+    def values_list(self, *fields):
+        return self.rows
+
+
+class ListObjectsV2KeysetPaginationTests(SimpleTestCase):
+    """
+    ListObjectsV2按id倒序的keyset分页
+    """
+    def setUp(self):
+        ids = [5, 2, 7, 1, 6, 3, 4]
+        self.queryset = FakeObjectQuerySet([(i, f'obj{i}', i, '', None, None, True) for i in ids])
+
+    def paginate(self, **params):
+        request = SimpleNamespace(query_params=params)
+        paginator = ListObjectsV2CursorPagination(context={'bucket_name': 'test'})
+        data = paginator.paginate_queryset(self.queryset, request)
+        return paginator, data
+
+    def test_continuation(self):
+        paginator, data = self.paginate(**{'max-keys': '3'})
+        self.assertEqual([r.id for r in data], [7, 6, 5])
+        page = paginator.get_paginated_data()
+        self.assertEqual(page['IsTruncated'], 'true')
+        self.assertEqual(page['KeyCount'], 3)
+        self.assertNotIn('ContinuationToken', page)
+
+        ids = [r.id for r in data]
+        token = page['NextContinuationToken']
+        while token:
+            paginator, data = self.paginate(**{'max-keys': '3', 'continuation-token': token})
+            page = paginator.get_paginated_data()
+            self.assertEqual(page['ContinuationToken'], token)
+            ids += [r.id for r in data]
+            token = page.get('NextContinuationToken')
+
+        self.assertEqual(ids, [7, 6, 5, 4, 3, 2, 1])
+        self.assertEqual(page['IsTruncated'], 'false')
+        self.assertEqual(page['KeyCount'], 1)
+
+    def test_last_page_exactly_full(self):
+        paginator, data = self.paginate(**{'max-keys': '7'})
+        self.assertEqual(len(data), 7)
+        self.assertFalse(paginator.has_next)
+        self.assertIsNone(paginator.get_next_continuation_token())
+
+    def test_invalid_token(self):
+        with self.assertRaises(exceptions.S3InvalidArgument):
+            self.paginate(**{'continuation-token': 'abc!'})
+
+
+class PutObjectStreamTests(SimpleTestCase):
+    """
+    PutObject从请求体流读取数据时的大小检查
+    """
+    def setUp(self):
+        patcher = mock.patch.object(ObjViewSet, 'exception_response', side_effect=lambda request, exc: exc)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.rados = mock.Mock()
+        self.rados.write_chunks.side_effect = lambda chunks, offset, max_in_flight: (
+            True, sum(len(c) for c in chunks))
+
+    def put(self, body: bytes, content_length):
+        view = ObjViewSet()
+        view.request = request = SimpleNamespace(headers={'Content-Length': str(content_length)},
+                                                 stream=io.BytesIO(body))
+        obj = mock.Mock()
+        ret = view.put_object_handle(request=request, bucket=mock.Mock(), obj=obj, rados=self.rados, created=True)
+        return ret, obj
+
+    def test_incomplete_body(self):
+        ret, obj = self.put(b'12345', content_length=10)
+        self.assertIsInstance(ret, exceptions.S3IncompleteBody)
+        self.rados.delete.assert_called_once_with(obj_size=5)
+        obj.do_delete.assert_called_once()
+
+    @override_settings(CUSTOM_UPLOAD_MAX_FILE_SIZE=4)
+    def test_entity_too_large(self):
+        ret, obj = self.put(b'12345', content_length=5)
+        self.assertIsInstance(ret, exceptions.S3EntityTooLarge)
+        self.rados.write_chunks.assert_not_called()
+        obj.do_delete.assert_called_once()
+
+    def test_missing_content_length(self):
+        ret, obj = self.put(b'12345', content_length='')
+        self.assertIsInstance(ret, exceptions.S3MissingContentLength)
+        self.rados.write_chunks.assert_not_called()
+
+
+class DeleteObjectsBatchTests(SimpleTestCase):
+    """
+    DeleteObjects批量删除对象
+    """
+    @staticmethod
+    def build_obj(obj_id, fod=True):
+        obj = mock.Mock(id=obj_id, si=0)
+        obj.is_file.return_value = fod
+        obj.is_dir.return_value = not fod
+        return obj
+
+    def test_delete_objects_batch(self):
+        file1, file2, dir1 = self.build_obj(1), self.build_obj(2), self.build_obj(3, fod=False)
+        bfm = mock.Mock()
+        bfm.get_objs_by_paths.return_value = {
+            'a': [file1], 'b': [file2], 'd': [dir1], 'dup': [self.build_obj(4), self.build_obj(5)]}
+        file_error = exceptions.S3InternalError()
+        hm = HarborManager()
+        with mock.patch.object(HarborManager, 'do_delete_objects', return_value={2: file_error}) as do_delete, \
+                mock.patch.object(HarborManager, 'do_delete_obj_or_dir') as do_delete_dir:
+            errors = hm._delete_objects_batch(bucket=mock.Mock(), bfm=bfm, keys=['a', 'b', 'd/', 'missing', 'dup'])
+
+        self.assertEqual(errors[:4], [None, file_error, None, None])
+        self.assertIsInstance(errors[4], exceptions.S3InternalError)
+        self.assertEqual(do_delete.call_args.kwargs['objs'], [file1, file2])
+        do_delete_dir.assert_called_once()
+        self.assertIs(do_delete_dir.call_args.kwargs['obj'], dir1)
+
+    def test_query_error(self):
+        bfm = mock.Mock()
+        bfm.get_objs_by_paths.side_effect = Exception('db error')
+        errors = HarborManager()._delete_objects_batch(bucket=mock.Mock(), bfm=bfm, keys=['a', 'b'])
+        self.assertEqual(len(errors), 2)
+        self.assertIsInstance(errors[0], exceptions.S3InternalError)
+        self.assertIsNot(errors[0], errors[1])
+
+    @mock.patch('s3api.harbor.ObjectPartManager')
+    @mock.patch('s3api.harbor.build_harbor_object')
+    def test_do_delete_objects_restores_failed(self, build_ho, part_manager):
+        model = type('FakeObject', (), {'objects': mock.MagicMock()})
+        objs = []
+        for i in (1, 2, 3):
+            obj = model()
+            obj.id, obj.si = i, 0
+            obj.get_obj_key = mock.Mock(return_value=f'key{i}')
+            obj.do_save = mock.Mock()
+            objs.append(obj)
+
+        results = {'key1': (True, ''), 'key2': (False, 'rados error'), 'key3': (True, '')}
+        build_ho.side_effect = lambda using, pool_name, obj_id, obj_size: mock.Mock(
+            aio_delete=mock.Mock(return_value=lambda: results[obj_id]))
+        bucket = mock.Mock()
+        bucket.is_s3_bucket.return_value = True
+
+        errors = HarborManager.do_delete_objects(bucket=bucket, objs=objs)
+        model.objects.filter.assert_called_once_with(id__in=[1, 2, 3])
+        self.assertEqual(list(errors), [2])
+        objs[1].do_save.assert_called_once_with(force_insert=True)
+        objs[0].do_save.assert_not_called()
+        part_manager.return_value.remove_objects_parts.assert_called_once_with(obj_ids=[1, 3])
+
+
+class ObjectRangeTests(SimpleTestCase):
+    """
+    GetObject请求头Range解析
+    """
+    def test_parse_header_range(self):
+        cases = [
+            ('bytes=0-99', (0, 99)),
+            ('bytes=100-', (100, None)),
+            ('bytes=-500', (None, 500)),
+            ('bytes=0-99,200-299', (0, 99)),     # 多个范围只取第一个
+            ('bytes=5-2', (None, None)),
+            ('bytes=-', (None, None)),
+            ('bytes=abc', (None, None)),
+            ('bytes=a-b', (None, None)),
+            ('items=0-99', (None, None)),
+            ('', (None, None)),
+        ]
+        for h_range, expected in cases:
+            with self.subTest(h_range=h_range):
+                self.assertEqual(ObjViewSet.parse_header_range(h_range), expected)
+
+    def test_get_object_offset_and_end(self):
+        view = ObjViewSet()
+        cases = [
+            ('bytes=0-99', (0, 99)),
+            ('bytes=900-2000', (900, 999)),
+            ('bytes=100-', (100, 999)),
+            ('bytes=-100', (900, 999)),
+            ('bytes=-2000', (0, 999)),
+            ('bytes=0-99,200-299', (0, 99)),
+        ]
+        for h_range, expected in cases:
+            with self.subTest(h_range=h_range):
+                self.assertEqual(view.get_object_offset_and_end(h_range, filesize=1000), expected)
+
+    def test_invalid_range(self):
+        view = ObjViewSet()
+        for h_range in ('bytes=1000-', 'bytes=5-2', 'bytes=-', 'bytes=abc', 'items=0-99'):
+            with self.subTest(h_range=h_range):
+                with self.assertRaises(exceptions.S3InvalidRange):
+                    view.get_object_offset_and_end(h_range, filesize=1000)
@@ -1,7 +1,9 @@
 import random
+import time
 import logging
 import traceback
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from django.db.backends.mysql.schema import DatabaseSchemaEditor
 from django.db import connections, router
@@ -82,12 +84,11 @@ def create_table_for_model_class(model, ):
             if issubclass(model, BucketFileBase):
                 try:
                     table_name = schema_editor.quote_name(model._meta.db_table)
-                    sql1 = f"ALTER TABLE {table_name} CHANGE COLUMN `na` `na` LONGTEXT NOT " \
-                           f"NULL COLLATE 'utf8_bin' AFTER `id`;"
-                    sql2 = f"ALTER TABLE {table_name} CHANGE COLUMN `name` `name` VARCHAR(255) " \
-                           f"NOT NULL COLLATE 'utf8_bin' AFTER `na_md5`;"
-                    schema_editor.execute(sql=sql1)
-                    schema_editor.execute(sql=sql2)
+                    # 两列的修改合并为一条DDL，只重建一次表
+                    sql = f"ALTER TABLE {table_name} " \
+                          f"CHANGE COLUMN `na` `na` LONGTEXT NOT NULL COLLATE 'utf8_bin' AFTER `id`, " \
+                          f"CHANGE COLUMN `name` `name` VARCHAR(255) NOT NULL COLLATE 'utf8_bin' AFTER `na_md5`;"
+                    schema_editor.execute(sql=sql)
                 except Exception as exc:
                     if delete_table_for_model_class(model):
                         raise exc       # model table 删除成功，抛出错误
@@ -123,6 +124,68 @@ def delete_table_for_model_class(model):
     return True
 
 
+def create_table_for_model_class_retry(model, retry_delays=(0.1, 0.5)):
+    """
+    创建Model类对应的数据库表，失败时等待一会后重试（如DDL锁等待超时等暂时性错误）；
+    重试前先检查表和索引是否都已创建成功(如DDL已执行但回复时连接错误)；表已存在但索引不全时(CREATE TABLE后
+    执行的索引DDL失败)，删除表后重新创建
+
+    :param model: Model类
+    :param retry_delays: 每次重试前等待的秒数
+    :return:
+            True: success
+            False: failure
+    """
+    if create_table_for_model_class(model=model):
+        return True
+
+    for delay in retry_delays:
+        time.sleep(delay)
+        try:
+            if is_model_table_exists(model):
+                if is_model_table_indexes_exists(model):
+                    return True
+
+                delete_table_for_model_class(model)
+        except Exception as e:
+            pass
+
+        if create_table_for_model_class(model=model):
+            return True
+
+    return False
+
+
+def _create_table_in_thread(model):
+    """
+    在工作线程中创建Model类的数据库表，线程结束前关闭此线程打开的数据库连接
+    """
+    try:
+        return create_table_for_model_class_retry(model=model)
+    finally:
+        connections.close_all()
+
+
+def create_tables_for_model_classes(models: list):
+    """
+    并发创建多个Model类对应的数据库表，除第一个外都在工作线程中各自的数据库连接上创建，DDL往返时间重叠
+
+    :param models: Model类列表
+    :return:
+        list    # 与models一一对应，True(success) or False(failure)
+    """
+    first, others = models[0], models[1:]
+    if not others:
+        return [create_table_for_model_class_retry(model=first)]
+
+    with ThreadPoolExecutor(max_workers=len(others)) as pool:
+        futures = [pool.submit(_create_table_in_thread, model) for model in others]
+        results = [create_table_for_model_class_retry(model=first)]
+        results += [f.result() for f in futures]
+
+    return results
+
+
 def is_model_table_exists(model):
     """
     检查模型类Model的数据库表是否已存在
@@ -135,7 +198,58 @@ def is_model_table_exists(model):
         db_table = model._meta.db_table
     else:
         db_table = model.Meta.db_table
-    return db_table in connection.introspection.table_names()
+
+    # 只查询这一个表，不列出库中所有的表（每个桶2个表，表数量很多）
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                       [db_table])
+        return cursor.fetchone() is not None
+
+
+def is_model_table_indexes_exists(model):
+    """
+    检查模型类Model的数据库表中，模型定义的索引(Meta.indexes和db_index字段)是否都已存在
+
+    :param model:
+    :return: True(都存在); False(缺少索引)
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+
+    index_names = {name for name, c in constraints.items() if c['index'] or c['unique']}
+    index_columns = [tuple(c['columns']) for c in constraints.values() if c['index'] or c['unique']]
+    for index in model._meta.indexes:
+        if index.name not in index_names:
+            return False
+
+    for field in model._meta.local_fields:
+        if (field.db_index or field.unique) and not field.primary_key:
+            if not any(cols and cols[0] == field.column for cols in index_columns):
+                return False
+
+    return True
+
+
+def get_model_column_type(model, column: str):
+    """
+    查询模型类数据库表一个列的数据类型
+
+    :param model: 模型类
+    :param column: 列名
+    :return:
+        str     # 小写的数据类型，如'binary'、'char'
+        None    # 表或列不存在
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                       "AND TABLE_NAME = %s AND COLUMN_NAME = %s", [model._meta.db_table, column])
+        row = cursor.fetchone()
+
+    return row[0].lower() if row else None
 
 
 def get_obj_model_class(table_name):
@@ -449,6 +563,30 @@ class BucketFileManagement:
 
         return obj
 
+    def get_objs_by_paths(self, paths: list):
+        """
+        一次查询获取多个目录或对象
+
+        :param paths: 目录或对象路径列表
+        :return:
+            dict    # {path: [obj, ]}，不存在的路径不包含在内
+
+        :raises: Exception
+        """
+        na_md5s = [get_str_hexMD5(path) for path in paths]
+        model_class = self.get_obj_model_class()
+        try:
+            objs = model_class.objects.filter(Q(na_md5__in=na_md5s) | Q(na_md5__isnull=True), na__in=paths)
+            ret = {}
+            for obj in objs:
+                ret.setdefault(obj.na, []).append(obj)
+        except Exception as e:
+            msg = f'select {self.get_collection_name()},paths count={len(paths)},err={str(e)}'
+            logger.error(msg)
+            raise Exception(msg)
+
+        return ret
+
     def get_objects_dirs_queryset(self):
         """
         获得所有文件对象和目录记录
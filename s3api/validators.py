@@ -6,9 +6,9 @@ from rest_framework.serializers import ValidationError
 from buckets.models import Bucket, BucketLimitConfig
 
 
-dns_regex = re.compile(r'(?!-)'             # can't start with a -
-                       r'[a-zA-Z0-9-]{,63}'
-                       r'(?<!-)$')          # can't end with a dash
+dns_regex = re.compile(r'[a-zA-Z0-9]'                         # can't start with a -
+                       r'(?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?$',   # can't end with a dash
+                       re.ASCII)
 
 LABEL_RE = re.compile(r'[a-z0-9][a-z0-9\-]*[a-z0-9]')
 
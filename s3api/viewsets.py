@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.utils import timezone
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from django.core.exceptions import PermissionDenied
 from rest_framework.viewsets import GenericViewSet
 from rest_framework import status
@@ -12,6 +12,31 @@ from . import exceptions
 from .renders import CusXMLRenderer
 
 
+_ERROR_RENDERER = CusXMLRenderer(root_tag_name='Error')     # 无状态，所有错误回复共用
+_ERROR_XML_CACHE = {}       # (code, message) -> 渲染好的错误xml bytes，只缓存默认错误描述的错误
+
+
+def get_prerendered_error_xml(exc):
+    """
+    错误描述为默认描述的S3Error，xml内容是固定的，渲染一次后缓存复用
+
+    :param exc: S3Error()
+    :return:
+        bytes   # 可复用的错误xml
+        None    # 非默认错误描述，不缓存
+    """
+    if exc.message != type(exc).default_message:
+        return None
+
+    key = (exc.code, exc.message)
+    content = _ERROR_XML_CACHE.get(key)
+    if content is None:
+        content = _ERROR_RENDERER.render(exc.err_data())
+        _ERROR_XML_CACHE[key] = content
+
+    return content
+
+
 def exception_handler(exc, context):
     """
     Returns the response that should be used for any given exception.
@@ -78,20 +103,26 @@ class CustomGenericViewSet(GenericViewSet):
     @staticmethod
     def get_bucket_name(request):
         """
-        从域名host中取bucket name
+        从域名host中取bucket name，结果缓存在request上，一个请求中多次调用只解析一次
 
         :return: str
             bucket name     # BucketName.SERVER_HTTP_HOST_NAME
             ''              # SERVER_HTTP_HOST_NAME or other
         """
+        bucket_name = getattr(request, '_s3_bucket_name', None)
+        if bucket_name is not None:
+            return bucket_name
+
+        bucket_name = ''
         main_hosts = getattr(settings, 'SERVER_HTTP_HOST_NAME', ['s3.obs.cstcloud.cn'])
         host = request.get_host()
         for main_host in main_hosts:
             if host.endswith('.' + main_host):
                 bucket_name, _ = host.split('.', maxsplit=1)
-                return bucket_name
+                break
 
-        return ''
+        request._s3_bucket_name = bucket_name
+        return bucket_name
 
     @staticmethod
     def get_s3_obj_key(request):
@@ -153,7 +184,7 @@ class CustomGenericViewSet(GenericViewSet):
             self.raise_uncaught_exception(exc)
 
         response.exception = True
-        self.set_renderer(self.request, CusXMLRenderer(root_tag_name='Error'))
+        self.set_renderer(self.request, _ERROR_RENDERER)
         return response
 
     def exception_response(self, request, exc):
@@ -162,9 +193,14 @@ class CustomGenericViewSet(GenericViewSet):
 
         :param request:
         :param exc: S3Error()
-        :return: Response()
+        :return: Response() or HttpResponse()
         """
-        self.set_renderer(request, CusXMLRenderer(root_tag_name='Error'))  # xml渲染器
+        content = get_prerendered_error_xml(exc)
+        if content is not None:     # 不经过Response和渲染器
+            content_type = f'{_ERROR_RENDERER.media_type}; charset={_ERROR_RENDERER.charset}'
+            return HttpResponse(content=content, status=exc.status_code, content_type=content_type)
+
+        self.set_renderer(request, _ERROR_RENDERER)  # xml渲染器
         return Response(data=exc.err_data(), status=exc.status_code)
 
     def head(self, request, *args, **kwargs):
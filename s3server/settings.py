@@ -267,6 +267,10 @@ REST_FRAMEWORK = {
 
 S3_MULTIPART_UPLOAD_MAX_SIZE = 2 * 1024 ** 3        # 2GB
 S3_MULTIPART_UPLOAD_MIN_SIZE = 5 * 1024 ** 2        # 5MB
+S3_PRELOAD_PARTS_MODEL_CLASSES = False    # 每个进程收到第一个请求时为已存在的存储桶预创建对象part模型类
+S3_BUCKET_CACHE_TIMEOUT = 0     # 存储桶元数据缓存时长(秒)，0不缓存；只在CACHES配置了共享缓存(如Redis)时生效，进程内缓存无法在其他进程失效
+S3_GET_OBJECT_READ_AHEAD_BYTES = 32 * 1024 ** 2     # 下载对象时预读(异步读取进行中)的最大数据量
+S3_DOWNLOAD_COUNT_FLUSH_INTERVAL = 0    # 对象下载次数延迟批量写入数据库的间隔(秒)，默认0每次下载同步写入，大于0时启用延迟批量写入
 
 CORS_ALLOW_ALL_ORIGINS = True       # 允许所有请求来源跨域
 CORS_ALLOW_HEADERS = ['*', ]
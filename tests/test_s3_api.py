@@ -5,6 +5,11 @@ import os
 import hashlib
 import random
 import io
+import math
+import base64
+import socket
+import http.client
+from urllib import parse
 from datetime import datetime
 from string import printable
 
@@ -482,6 +487,237 @@ def test_delete_bucket(s3, bucket_name):
             print(f'@@@ [OK], test_delete_bucket')
 
 
+def put_small_objects(s3, bucket_name, prefix, count: int):
+    keys = []
+    for i in range(count):
+        key = f'{prefix}obj_{i}.txt'
+        s3.put_object(Bucket=bucket_name, Key=key, Body=f'object {i}'.encode())
+        keys.append(key)
+
+    return keys
+
+
+def list_objects_v2_page(s3, bucket_name, prefix, max_keys, token=None):
+    params = {'Bucket': bucket_name, 'Prefix': prefix, 'MaxKeys': max_keys}
+    if token:
+        params['ContinuationToken'] = token
+
+    r = s3.list_objects_v2(**params)
+    keys = [o['Key'] for o in r.get('Contents', [])]
+    return keys, r
+
+
+def test_list_objects_v2_continuation(s3, bucket_name, prefix='test_continuation/', count=7, max_keys=2):
+    """
+    continuation-token分页往返：每个对象只列举一次；兼容旧格式token('p=<id>')；无效token返回InvalidArgument
+    """
+    put_keys = put_small_objects(s3=s3, bucket_name=bucket_name, prefix=prefix, count=count)
+    try:
+        # 逐页列举，直到IsTruncated为false
+        listed = []
+        pages = 0
+        token = None
+        first_next_token = None
+        while True:
+            keys, r = list_objects_v2_page(s3, bucket_name, prefix=prefix, max_keys=max_keys, token=token)
+            pages += 1
+            listed += keys
+            if r.get('KeyCount') != len(keys):
+                print(f'@@@ [Failed], test_list_objects_v2_continuation, KeyCount({r.get("KeyCount")}) != {len(keys)}')
+                raise Exception
+            if token and r.get('ContinuationToken') != token:
+                print(f'@@@ [Failed], test_list_objects_v2_continuation, ContinuationToken not echoed')
+                raise Exception
+
+            if not r.get('IsTruncated'):
+                if r.get('NextContinuationToken'):
+                    print(f'@@@ [Failed], test_list_objects_v2_continuation, NextContinuationToken on last page')
+                    raise Exception
+                break
+
+            token = r.get('NextContinuationToken')
+            if not token:
+                print(f'@@@ [Failed], test_list_objects_v2_continuation, IsTruncated but no NextContinuationToken')
+                raise Exception
+            if first_next_token is None:
+                first_next_token = token
+
+        if len(listed) != len(set(listed)) or sorted(listed) != sorted(put_keys):
+            print(f'@@@ [Failed], test_list_objects_v2_continuation, listed keys({listed}) != put keys({put_keys})')
+            raise Exception
+        if pages != math.ceil(count / max_keys):
+            print(f'@@@ [Failed], test_list_objects_v2_continuation, pages({pages}) != {math.ceil(count / max_keys)}')
+            raise Exception
+
+        # 旧格式token：base64('p=<id>')，与新格式token列举同一页
+        position = base64.urlsafe_b64decode(first_next_token.encode()).decode()
+        legacy_token = base64.b64encode(f'p={position}'.encode()).decode()
+        keys_new, _ = list_objects_v2_page(s3, bucket_name, prefix=prefix, max_keys=max_keys, token=first_next_token)
+        keys_legacy, _ = list_objects_v2_page(s3, bucket_name, prefix=prefix, max_keys=max_keys, token=legacy_token)
+        if keys_new != keys_legacy:
+            print(f'@@@ [Failed], test_list_objects_v2_continuation, legacy token page({keys_legacy}) != {keys_new}')
+            raise Exception
+
+        # 无效token
+        try:
+            list_objects_v2_page(s3, bucket_name, prefix=prefix, max_keys=max_keys, token='not-a-token!')
+        except ClientError as e:
+            if not assert_error_code(e, ['invalidargument']):
+                print(f'@@@ [Failed], test_list_objects_v2_continuation, invalid token, {str(e)}')
+                raise e
+        else:
+            print(f'@@@ [Failed], test_list_objects_v2_continuation, invalid token accepted')
+            raise Exception
+
+        print(f'@@@ [OK], test_list_objects_v2_continuation')
+    finally:
+        s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': k} for k in put_keys], 'Quiet': True})
+
+
+def raw_put_object(s3, bucket_name, key, body: bytes, content_length: int, shutdown_write=False):
+    """
+    用预签名url发送PUT请求，可以指定与请求体不一致的Content-Length
+
+    :param shutdown_write: True(发送完请求体后关闭连接写端，模拟客户端中断)
+    :return: (status, response body)
+    """
+    url = s3.generate_presigned_url('put_object', Params={'Bucket': bucket_name, 'Key': key}, ExpiresIn=600)
+    (scheme, netloc, path, query, fragment) = parse.urlsplit(url)
+    if scheme == 'https':
+        conn = http.client.HTTPSConnection(netloc, timeout=60)
+    else:
+        conn = http.client.HTTPConnection(netloc, timeout=60)
+
+    try:
+        conn.putrequest('PUT', f'{path}?{query}', skip_accept_encoding=True)
+        conn.putheader('Content-Length', str(content_length))
+        conn.endheaders()
+        conn.send(body)
+        if shutdown_write:
+            conn.sock.shutdown(socket.SHUT_WR)
+
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        conn.close()
+
+
+def assert_object_not_exists(s3, bucket_name, key):
+    try:
+        s3.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) == 404:
+            return True
+
+        raise e
+
+    return False
+
+
+def test_put_object_invalid(s3, bucket_name, key='test_put_invalid/obj.data'):
+    """
+    PUT请求体与Content-Length不一致、请求体不完整、Content-MD5错误时，不能留下对象
+    """
+    body = os.urandom(1024 * 1024 + 1)
+    body_md5 = hashlib.md5(body)
+
+    # Content-MD5与请求体不一致
+    wrong_md5 = base64.b64encode(hashlib.md5(body + b'x').digest()).decode()
+    try:
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body, ContentMD5=wrong_md5)
+    except ClientError as e:
+        if not assert_error_code(e, ['baddigest']):
+            print(f'@@@ [Failed], test_put_object_invalid, bad Content-MD5, {str(e)}')
+            raise e
+    else:
+        print(f'@@@ [Failed], test_put_object_invalid, bad Content-MD5 accepted')
+        raise Exception
+    if not assert_object_not_exists(s3, bucket_name, key):
+        print(f'@@@ [Failed], test_put_object_invalid, object exists after bad Content-MD5')
+        raise Exception
+
+    # Content-MD5不是有效的MD5
+    try:
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body, ContentMD5='not-md5')
+    except ClientError as e:
+        if not assert_error_code(e, ['invaliddigest']):
+            print(f'@@@ [Failed], test_put_object_invalid, invalid Content-MD5, {str(e)}')
+            raise e
+    else:
+        print(f'@@@ [Failed], test_put_object_invalid, invalid Content-MD5 accepted')
+        raise Exception
+
+    # 请求体比Content-Length短，发送完后客户端关闭写端；读到流结尾(IncompleteBody)或读取出错(InvalidRequest)
+    status_code, content = raw_put_object(s3, bucket_name, key, body=body, content_length=len(body) + 1024,
+                                          shutdown_write=True)
+    if status_code != 400 or not (b'IncompleteBody' in content or b'InvalidRequest' in content):
+        print(f'@@@ [Failed], test_put_object_invalid, truncated body, status={status_code}, {content}')
+        raise Exception
+    if not assert_object_not_exists(s3, bucket_name, key):
+        print(f'@@@ [Failed], test_put_object_invalid, object exists after truncated body')
+        raise Exception
+
+    # Content-Length比请求体短，只保存Content-Length长度的数据
+    length = len(body) - 1024
+    status_code, content = raw_put_object(s3, bucket_name, key, body=body, content_length=length)
+    if status_code != 200:
+        print(f'@@@ [Failed], test_put_object_invalid, short Content-Length, status={status_code}, {content}')
+        raise Exception
+    r = s3.head_object(Bucket=bucket_name, Key=key)
+    etag = r.get('ETag', '').strip('"')
+    if r.get('ContentLength') != length or etag != hashlib.md5(body[:length]).hexdigest():
+        print(f'@@@ [Failed], test_put_object_invalid, short Content-Length, size={r.get("ContentLength")}, '
+              f'etag={etag}, expected size={length}')
+        raise Exception
+    s3.delete_object(Bucket=bucket_name, Key=key)
+
+    # 正确的请求仍然成功
+    r = s3.put_object(Bucket=bucket_name, Key=key, Body=body,
+                      ContentMD5=base64.b64encode(body_md5.digest()).decode())
+    if r.get('ETag', '').strip('"') != body_md5.hexdigest():
+        print(f'@@@ [Failed], test_put_object_invalid, valid put ETag({r.get("ETag")}) != {body_md5.hexdigest()}')
+        raise Exception
+    s3.delete_object(Bucket=bucket_name, Key=key)
+
+    print(f'@@@ [OK], test_put_object_invalid')
+
+
+def test_delete_objects_batch(s3, bucket_name, prefix='test_delete_batch/', count=150):
+    """
+    一次删除多批(每批100个)对象，存在和不存在的key混合，重复的key；不存在的key也在Deleted中
+    """
+    put_keys = put_small_objects(s3=s3, bucket_name=bucket_name, prefix=prefix, count=count)
+    missing_keys = [f'{prefix}missing_{i}.txt' for i in range(count // 10)]
+    keys = []
+    for i, key in enumerate(put_keys):
+        keys.append(key)
+        if i % 10 == 0:
+            keys.append(missing_keys[i // 10])
+
+    keys.append(put_keys[0])        # 重复的key
+
+    r = s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': k} for k in keys], 'Quiet': False})
+    deleted = [o.get('Key') for o in r.get('Deleted', [])]
+    errors = r.get('Errors', [])
+    if errors:
+        print(f'@@@ [Failed], test_delete_objects_batch, Errors={errors}')
+        raise Exception
+    if sorted(deleted) != sorted(keys):
+        print(f'@@@ [Failed], test_delete_objects_batch, Deleted keys != request keys')
+        raise Exception
+
+    keys_left, _ = list_objects_v2_page(s3, bucket_name, prefix=prefix, max_keys=1000)
+    if keys_left:
+        print(f'@@@ [Failed], test_delete_objects_batch, objects left after delete: {keys_left}')
+        raise Exception
+    for key in (put_keys[0], put_keys[-1]):
+        if not assert_object_not_exists(s3, bucket_name, key):
+            print(f'@@@ [Failed], test_delete_objects_batch, object {key} exists after delete')
+            raise Exception
+
+    print(f'@@@ [OK], test_delete_objects_batch')
+
+
 if __name__ == "__main__":
     mb_num = 25
     generate_file(FILENAME, mb_num)         # 生成一个上传用的文件
@@ -507,6 +743,9 @@ if __name__ == "__main__":
     # test_multipart_upload(s3=S3, bucket_name=BUCKET_NAME, key=multipart_key, filename=FILENAME,
     #                       part_size=part_size)
     # test_delete_objects(s3=S3, bucket_name=BUCKET_NAME, keys=[multipart_key])
+    # test_list_objects_v2_continuation(s3=S3, bucket_name=BUCKET_NAME)
+    # test_put_object_invalid(s3=S3, bucket_name=BUCKET_NAME)
+    # test_delete_objects_batch(s3=S3, bucket_name=BUCKET_NAME)
     # test_delete_bucket(s3=S3, bucket_name=BUCKET_NAME)
 
     remove_file(FILENAME)
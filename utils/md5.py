@@ -1,5 +1,7 @@
 import hashlib
+import hmac
 import base64
+import binascii
 
 
 EMPTY_HEX_MD5 = 'd41d8cd98f00b204e9800998ecf8427e'
@@ -19,6 +21,26 @@ def from_b64(s: str):
     return bs.decode("utf-8")
 
 
+def b64_md5_equal(b64_md5: str, bytes_md5: bytes):
+    """
+    比较请求头Content-MD5（base64编码）与二进制MD5是否一致，常量时间比较
+
+    :param b64_md5: base64编码的MD5
+    :param bytes_md5: 16字节二进制MD5
+    :return: True(一致); False(不一致)
+    :raises: ValueError     # b64_md5不是有效的base64编码MD5
+    """
+    try:
+        expected = base64.b64decode(b64_md5, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError('invalid base64 md5')
+
+    if len(expected) != 16:
+        raise ValueError('invalid base64 md5')
+
+    return hmac.compare_digest(expected, bytes_md5)
+
+
 class FileHashHandlerBase:
     """
     hash计算
@@ -124,6 +146,13 @@ def get_str_hexMD5(s: str):
     return hashlib.md5(s.encode(encoding='utf-8')).hexdigest()
 
 
+def get_str_bytesMD5(s: str):
+    """
+    求字符串MD5, 16字节二进制
+    """
+    return hashlib.md5(s.encode(encoding='utf-8')).digest()
+
+
 def md5_hex_to_bytes(s: str):
     return bytes.fromhex(s)
 
@@ -1,8 +1,12 @@
 import os
 import math
+import errno
 import json
 import datetime
 import pytz
+import threading
+from collections import deque
+from contextlib import contextmanager
 
 import rados
 
@@ -183,9 +187,45 @@ class CephClusterCommand(dict):
                 self.update(json.loads(buf))
 
 
+_shared_clusters = {}       # 进程内共享的已连接集群句柄，(pid, cluster_name, user_name, conf_file, keyring_file) -> Rados()
+_shared_clusters_lock = threading.Lock()
+_local = threading.local()  # 线程缓存的存储池ioctx，_local.ioctxs: {pool_name: (Rados(), Ioctx())}
+
+
+def get_shared_cluster(key, connect):
+    """
+    获取进程内共享的已连接集群句柄，不存在或已断开时调用connect()创建连接
+
+    :param key: 集群配置标识
+    :param connect: 创建并连接集群的函数，connect() -> Rados()
+    :return: Rados()
+    :raises: class:`RadosError`
+    """
+    cluster = _shared_clusters.get(key)
+    if cluster is not None and cluster.state.lower() == 'connected':
+        return cluster
+
+    with _shared_clusters_lock:
+        cluster = _shared_clusters.get(key)
+        if cluster is not None:
+            if cluster.state.lower() == 'connected':
+                return cluster
+
+            try:
+                cluster.shutdown()
+            except Exception:
+                pass
+
+        cluster = connect()
+        _shared_clusters[key] = cluster
+        return cluster
+
+
 class RadosAPI:
     """
     ceph cluster rados对象接口封装
+
+    集群连接在进程内共享，存储池ioctx按线程缓存复用，不再每次请求都连接集群和打开ioctx
     """
 
     def __init__(self, cluster_name, user_name, pool_name, conf_file, keyring_file='', *args, **kwargs):
@@ -222,35 +262,106 @@ class RadosAPI:
             success: Rados()
         :raises: class:`RadosError`
         """
-        if self._cluster:
-            if self._cluster.state.lower() == 'connected':
-                return self._cluster
-            else:
-                self._cluster.shutdown()
-                self._cluster = None
-
-        if not self._cluster:
-            conf = {'client_mount_timeout': '15', 'rados_mon_op_timeout': '15', 'rados_osd_op_timeout': '15'}
-            if self._keyring_file:
-                conf['keyring'] = self._keyring_file
-            self._cluster = rados.Rados(name=self._user_name, clustername=self._cluster_name, conffile=self._conf_file,
-                                        conf=conf)
-            try:
-                self._cluster.connect()
-            except rados.Error as e:
-                self._cluster = None
-                msg = e.args[0] if e.args else 'error connecting to the cluster'
-                raise RadosError(msg, errno=e.errno)
+        if self._cluster and self._cluster.state.lower() == 'connected':
+            return self._cluster
 
+        key = (os.getpid(), self._cluster_name, self._user_name, self._conf_file, self._keyring_file)
+        self._cluster = get_shared_cluster(key=key, connect=self._connect_cluster)
         return self._cluster
 
+    def _connect_cluster(self):
+        """
+        创建并连接集群
+
+        :return: Rados()
+        :raises: class:`RadosError`
+        """
+        conf = {'client_mount_timeout': '15', 'rados_mon_op_timeout': '15', 'rados_osd_op_timeout': '15'}
+        if self._keyring_file:
+            conf['keyring'] = self._keyring_file
+        cluster = rados.Rados(name=self._user_name, clustername=self._cluster_name, conffile=self._conf_file,
+                              conf=conf)
+        try:
+            cluster.connect()
+        except rados.Error as e:
+            msg = e.args[0] if e.args else 'error connecting to the cluster'
+            raise RadosError(msg, errno=e.errno)
+
+        return cluster
+
     def clear_cluster(self, cluster=None):
-        if cluster:
+        """
+        释放集群句柄的引用；共享的集群连接由进程持有，不断开
+        """
+        if cluster and cluster not in _shared_clusters.values():
             cluster.shutdown()
 
-        if self._cluster is not None:
-            self._cluster.shutdown()
-            self._cluster = None
+        self._cluster = None
+
+    def get_ioctx(self):
+        """
+        获取当前线程缓存的存储池ioctx，不存在时打开；调用者不要关闭
+
+        :return: Ioctx()
+        :raises: class:`RadosError`
+        """
+        cluster = self.get_cluster()
+        ioctxs = getattr(_local, 'ioctxs', None)
+        if ioctxs is None:
+            ioctxs = _local.ioctxs = {}
+
+        item = ioctxs.get(self._pool_name)
+        if item is not None:
+            c, ioctx = item
+            if c is cluster and ioctx.state == 'open':
+                return ioctx
+
+        ioctx = self.create_ioctx()
+        ioctxs[self._pool_name] = (cluster, ioctx)
+        return ioctx
+
+    def create_ioctx(self):
+        """
+        打开一个存储池ioctx，不与其他调用者共享，调用者负责关闭；
+        用于异步读写删除流水线，避免其他调用者出错丢弃共享的ioctx时，本流水线进行中的异步操作被中断
+
+        :return: Ioctx()
+        :raises: class:`RadosError`
+        """
+        cluster = self.get_cluster()
+        try:
+            return cluster.open_ioctx(self._pool_name)
+        except rados.Error as e:
+            msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
+            raise RadosError(msg, errno=e.errno)
+
+    def discard_ioctx(self):
+        """
+        关闭并丢弃当前线程缓存的存储池ioctx，出错后下次重新打开；
+        共享的ioctx只用于同步操作，异步操作使用create_ioctx()打开的独立ioctx
+        """
+        ioctxs = getattr(_local, 'ioctxs', None)
+        item = ioctxs.pop(self._pool_name, None) if ioctxs else None
+        if item is not None:
+            try:
+                item[1].close()
+            except Exception:
+                pass
+
+    @contextmanager
+    def open_ioctx(self):
+        """
+        使用线程缓存的存储池ioctx，出现rados错误时丢弃ioctx
+
+        :raises: class:`RadosError`
+        """
+        ioctx = self.get_ioctx()
+        try:
+            yield ioctx
+        except rados.Error as e:
+            if not isinstance(e, rados.ObjectNotFound):
+                self.discard_ioctx()
+            raise
 
     @staticmethod
     def _io_write(ioctx, obj_id, offset, data: bytes):
@@ -288,9 +399,8 @@ class RadosAPI:
             success: True
         :raises: class:`RadosError`
         """
-        cluster = self.get_cluster()
         try:
-            with cluster.open_ioctx(self._pool_name) as ioctx:
+            with self.open_ioctx() as ioctx:
                 self._io_write(ioctx=ioctx, obj_id=obj_id, offset=offset, data=data)
         except rados.Error as e:
             msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
@@ -298,6 +408,32 @@ class RadosAPI:
 
         return True
 
+    def aio_write_chunks(self, obj_id, offset, chunks, max_in_flight=8):
+        """
+        异步流水线写入一系列数据块，最多max_in_flight个写操作同时进行，前一块等待osd确认时后一块已开始发送
+
+        :param obj_id: 对象id
+        :param offset: 第一个数据块写入偏移量
+        :param chunks: 可迭代的数据块，bytes
+        :param max_in_flight: 最多同时进行的异步写操作数
+        :return:
+            success: int    # 写入数据总长度
+        :raises: class:`RadosError`
+        """
+        writer = RadosAioWriter(rados_api=self, obj_id=obj_id, max_in_flight=max_in_flight)
+        written = 0
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+
+                writer.write(chunk, offset=offset + written)
+                written += len(chunk)
+        finally:
+            writer.flush()      # 等待所有已提交的写操作完成
+
+        return written
+
     def _io_write_file(self, ioctx, obj_id, offset, file, per_size=20 * 1024 ** 2):
         """
         向对象写入一个类文件数据
@@ -346,9 +482,8 @@ class RadosAPI:
             success: True
         :raises: class:`RadosError`
         """
-        cluster = self.get_cluster()
         try:
-            with cluster.open_ioctx(self._pool_name) as ioctx:
+            with self.open_ioctx() as ioctx:
                 self._io_write_file(ioctx=ioctx, obj_id=obj_id, offset=offset, file=file, per_size=per_size)
 
         except rados.Error as e:
@@ -399,10 +534,8 @@ class RadosAPI:
             return bytes()
 
         tasks = read_part_tasks(obj_id, offset=offset, bytes_len=read_size)
-        cluster = self.get_cluster()
-
         try:
-            with cluster.open_ioctx(self._pool_name) as ioctx:
+            with self.open_ioctx() as ioctx:
                 # 要读取的数据在一个rados对象上
                 if len(tasks) == 1:
                     obj_key, off, size = tasks[0]
@@ -421,6 +554,90 @@ class RadosAPI:
         except Exception as e:
             raise RadosError(str(e))
 
+    def aio_read_generator(self, obj_id, offset, end, block_size, depth=8):
+        """
+        流水线读取对象数据的生成器，保持最多depth个数据块的异步读操作在进行中，
+        每返回一个数据块前提交后续数据块的读操作，隐藏与osd间的往返延迟
+
+        预读窗口自适应：取数据块时读操作还未完成，说明读取跟不上客户端，窗口加倍(不超过depth)；
+        读操作早已完成，说明客户端接收慢，窗口减1，不为慢客户端占用过多内存
+
+        :param obj_id: 对象id
+        :param offset: 读起始偏移量
+        :param end: 读结束偏移量(不包含)
+        :param block_size: 每个数据块长度
+        :param depth: 最多同时进行读操作的数据块数
+        :return: generator
+        :raises: class:`RadosError`
+        """
+        ioctx = self.create_ioctx()
+
+        pending = deque()   # 每项为一个数据块的读操作列表[(read_size, completion, result), ]
+        next_offset = offset
+
+        def submit_block():
+            nonlocal next_offset
+            size = min(block_size, end - next_offset)
+            reads = []
+            for obj_key, off, read_size in read_part_tasks(obj_id, offset=next_offset, bytes_len=size):
+                result = {}
+
+                def on_complete(completion, data, _result=result):
+                    _result['data'] = data
+
+                reads.append((read_size, ioctx.aio_read(obj_key, read_size, off, on_complete), result))
+
+            pending.append(reads)
+            next_offset += size
+
+        def wait_block(reads):
+            block = bytes()
+            for read_size, comp, result in reads:
+                comp.wait_for_complete_and_cb()
+                r = comp.get_return_value()
+                if r == -errno.ENOENT:      # rados对象不存在，构造一个指定长度的bytes
+                    data = bytes(read_size)
+                elif r < 0:
+                    raise RadosError('Failed to read bytes from rados object', errno=-r)
+                else:
+                    data = result.get('data') or bytes()
+                    if len(data) < read_size:   # 读取数据不足，补足
+                        data += bytes(read_size - len(data))
+
+                block = data if not block else block + data
+
+            return block
+
+        window = min(2, depth)      # 预读窗口，进行中读操作的数据块数
+        try:
+            while next_offset < end and len(pending) < window:
+                submit_block()
+
+            while pending:
+                reads = pending.popleft()
+                if all(comp.is_complete() for _, comp, _ in reads):
+                    window = max(window - 1, 1)
+                else:
+                    window = min(window * 2, depth)
+
+                block = wait_block(reads)
+                while next_offset < end and len(pending) < window:
+                    submit_block()
+
+                yield block
+        except rados.Error as e:
+            if isinstance(e, RadosError):
+                raise e
+
+            msg = e.args[0] if e.args else 'Failed to read bytes from rados object'
+            raise RadosError(msg, errno=e.errno)
+        finally:
+            for reads in pending:       # 等待未完成的读操作
+                for _, comp, _ in reads:
+                    comp.wait_for_complete_and_cb()
+
+            ioctx.close()
+
     def delete(self, obj_id, obj_size):
         """
         删除对象
@@ -431,10 +648,8 @@ class RadosAPI:
             success: True
         :raises: class:`RadosError`
         """
-        cluster = self.get_cluster()
-
         try:
-            with cluster.open_ioctx(self._pool_name) as ioctx:
+            with self.open_ioctx() as ioctx:
                 hos = HarborObjectStructure(obj_id=obj_id, obj_size=obj_size)
                 for part_id in hos.parts_id:
                     try:
@@ -455,6 +670,48 @@ class RadosAPI:
         except Exception as e:
             raise RadosError(str(e))
 
+    def aio_delete(self, obj_id, obj_size):
+        """
+        异步删除对象，提交对象所有rados对象的删除操作后立即返回，调用返回的wait函数等待删除完成
+
+        :param obj_id: 对象id
+        :param obj_size: 对象大小
+        :return:
+            wait    # wait() -> True; raises RadosError
+        :raises: class:`RadosError`
+        """
+        ioctx = self.create_ioctx()
+
+        def wait_all(completions):
+            error = None
+            for part_id, comp in completions:      # 等待所有删除操作完成后再关闭ioctx
+                comp.wait_for_complete()
+                r = comp.get_return_value()
+                if r < 0 and r != -errno.ENOENT and error is None:
+                    error = RadosError(f'Failed to remove rados object {part_id}', errno=-r)
+
+            ioctx.close()
+            if error is not None:
+                raise error
+
+            return True
+
+        submitted = []
+        hos = HarborObjectStructure(obj_id=obj_id, obj_size=obj_size)
+        try:
+            for part_id in hos.parts_id:
+                submitted.append((part_id, ioctx.aio_remove(part_id)))
+        except rados.Error as e:
+            try:
+                wait_all(submitted)
+            except RadosError:
+                pass
+
+            msg = e.args[0] if e.args else f'Failed to remove rados object of {obj_id}'
+            raise RadosError(msg, errno=e.errno)
+
+        return lambda: wait_all(submitted)
+
     def rados_stat(self, obj_id):
         """
         获取rados对象大小和修改时间
@@ -464,9 +721,8 @@ class RadosAPI:
                 (int, datetime())   # size, mtime
         :raises: class:`RadosError`, `RadosNotFound`
         """
-        cluster = self.get_cluster()
         try:
-            with cluster.open_ioctx(self._pool_name) as ioctx:
+            with self.open_ioctx() as ioctx:
                 size, t = ioctx.stat(obj_id)
         except rados.ObjectNotFound:
             raise RadosNotFound('rados对象不存在')
@@ -613,6 +869,93 @@ class RadosAPI:
         return data
 
 
+class RadosAioWriter:
+    """
+    异步写入一个对象，最多max_in_flight个写操作同时进行，达到上限时等待最早提交的写操作完成；
+    flush()等待所有已提交的写操作完成
+    """
+    def __init__(self, rados_api: RadosAPI, obj_id, max_in_flight=8):
+        self._rados_api = rados_api
+        self._obj_id = obj_id
+        self._max_in_flight = max(max_in_flight, 1)
+        self._in_flight = deque()
+        self._ioctx = None      # 写入器独立的ioctx，所有写操作完成后关闭
+
+    def _get_ioctx(self):
+        if self._ioctx is None:
+            self._ioctx = self._rados_api.create_ioctx()
+
+        return self._ioctx
+
+    def _close_ioctx(self):
+        if self._ioctx is not None:
+            try:
+                self._ioctx.close()
+            except Exception:
+                pass
+
+            self._ioctx = None
+
+    def _drain(self):
+        """
+        等待所有已提交的写操作完成后关闭ioctx，忽略写操作结果
+        """
+        while self._in_flight:
+            comp, _ = self._in_flight.popleft()
+            comp.wait_for_complete()
+
+        self._close_ioctx()
+
+    def _wait_oldest(self):
+        """
+        等待最早提交的写操作完成；写操作失败时，先等待其余写操作完成，再关闭ioctx并抛出错误
+
+        :raises: class:`RadosError`
+        """
+        comp, _ = self._in_flight.popleft()     # 保持数据块的引用直到写操作完成
+        comp.wait_for_complete()
+        r = comp.get_return_value()
+        if r < 0:
+            self._drain()
+            raise RadosError('Failed to write bytes to rados object', errno=-r)
+
+    def write(self, data: bytes, offset):
+        """
+        提交异步写操作
+
+        :param data: 数据，bytes
+        :param offset: 数据写入偏移量
+        :raises: class:`RadosError`
+        """
+        try:
+            ioctx = self._get_ioctx()
+            tasks = write_part_tasks(self._obj_id, offset=offset, bytes_len=len(data))
+            for obj_key, off, start, end in tasks:
+                chunk = data[start:end] if len(tasks) > 1 else data
+                if len(self._in_flight) >= self._max_in_flight:
+                    self._wait_oldest()
+
+                self._in_flight.append((ioctx.aio_write(obj_key, chunk, offset=off), chunk))
+        except rados.Error as e:
+            if isinstance(e, RadosError):
+                raise e
+
+            self._drain()
+            msg = e.args[0] if e.args else 'Failed to write bytes to rados object'
+            raise RadosError(msg, errno=e.errno)
+
+    def flush(self):
+        """
+        等待所有已提交的写操作完成，有写操作失败时，也会等待其余写操作完成
+
+        :raises: class:`RadosError`
+        """
+        while self._in_flight:
+            self._wait_oldest()     # 写操作失败时，已等待其余写操作完成
+
+        self._close_ioctx()     # 所有写操作已完成，之后的写操作重新打开ioctx
+
+
 class HarborObjectBase:
     """
     HarborObject读写相关的封装类，要实现此基类的方法
@@ -790,6 +1133,39 @@ class HarborObject:
         self._obj_size = max(offset + block_size, self._obj_size)
         return True, 'write success'
 
+    def write_chunks(self, chunks, offset=0, max_in_flight=8):
+        """
+        异步流水线写入一系列数据块
+
+        :param chunks: 可迭代的数据块; type: bytes
+        :param offset: 写入起始偏移量; type: int
+        :param max_in_flight: 最多同时进行的异步写操作数
+        :return:
+            正常时：(True, int) int是写入数据总长度
+            错误时：(False, str) str是错误描述
+        """
+        if offset < 0:
+            return False, 'offset must be >=0'
+
+        try:
+            _rados = self.get_rados_api()
+            written = _rados.aio_write_chunks(obj_id=self._obj_id, offset=offset, chunks=chunks,
+                                              max_in_flight=max_in_flight)
+        except (RadosError, Exception) as e:
+            return False, str(e)
+
+        self._obj_size = max(offset + written, self._obj_size)
+        return True, written
+
+    def aio_writer(self, max_in_flight=8):
+        """
+        异步写入对象的写入器
+
+        :param max_in_flight: 最多同时进行的异步写操作数
+        :return: RadosAioWriter()
+        """
+        return RadosAioWriter(rados_api=self.get_rados_api(), obj_id=self._obj_id, max_in_flight=max_in_flight)
+
     def write_file(self, offset, file, per_size=20 * 1024 ** 2):
         """
         向对象写入一个类文件数据
@@ -828,6 +1204,33 @@ class HarborObject:
         self._obj_size = 0
         return True, 'delete success'
 
+    def aio_delete(self, obj_size=None):
+        """
+        异步删除对象，删除操作提交后立即返回，等待删除完成前可以做其他工作
+
+        :return:
+            wait    # 等待删除完成的函数，wait() -> (True, str) or (False, str)
+        """
+        size = obj_size if isinstance(obj_size, int) else self.get_obj_size()
+
+        try:
+            _rados = self.get_rados_api()
+            rados_wait = _rados.aio_delete(obj_id=self._obj_id, obj_size=size)
+        except (RadosError, Exception) as e:
+            err = str(e)
+            return lambda: (False, err)
+
+        def wait():
+            try:
+                rados_wait()
+            except (RadosError, Exception) as exc:
+                return False, str(exc)
+
+            self._obj_size = 0
+            return True, 'delete success'
+
+        return wait
+
     def read_obj_generator(self, offset=0, end=None, block_size=10 * 1024 ** 2):
         """
         读取对象生成器
@@ -861,6 +1264,38 @@ class HarborObject:
             else:
                 break
 
+    def aio_read_obj_generator(self, offset=0, end=None, block_size=4 * 1024 ** 2, depth=8):
+        """
+        流水线读取对象生成器，最多depth个数据块的读操作同时进行；只有一个数据块时同步读取
+
+        :param offset: 读起始偏移量；type: int
+        :param end: 读结束偏移量(包含)；type: int；None:表示对象结尾；
+        :param block_size: 每次读取数据块长度；type: int
+        :param depth: 最多同时进行读操作的数据块数
+        :return:
+        """
+        obj_size = self.get_obj_size()
+        if isinstance(end, int):
+            end_oft = min(end + 1, obj_size)  # 包括end,不大于对象大小
+        else:
+            end_oft = obj_size
+
+        oft = max(offset, 0)
+        blocks = math.ceil((end_oft - oft) / block_size) if end_oft > oft else 0
+        if blocks <= 1:
+            yield from self.read_obj_generator(offset=oft, end=end_oft - 1, block_size=block_size)
+            return
+
+        try:
+            _rados = self.get_rados_api()
+            for data_block in _rados.aio_read_generator(obj_id=self._obj_id, offset=oft, end=end_oft,
+                                                        block_size=block_size, depth=min(depth, blocks)):
+                oft += len(data_block)
+                yield data_block
+        except RadosError:
+            # 异步读取出错，剩余数据改为同步读取（同步读取失败时会重试一次）
+            yield from self.read_obj_generator(offset=oft, end=end_oft - 1, block_size=block_size)
+
     def write_obj_generator(self):
         """
         写入对象生成器
@@ -947,6 +1382,7 @@ class FileWrapper:
         self._ho = ho
         self.offset = 0
         self.closed = True
+        self._aio_writer = None
 
     def open(self):
         try:
@@ -958,6 +1394,7 @@ class FileWrapper:
         return self
 
     def close(self):
+        self.drain()
         self.closed = True
         self._ho.get_rados_api().clear_cluster()
 
@@ -992,6 +1429,39 @@ class FileWrapper:
         self.offset += wl
         return wl
 
+    def aio_write(self, data, offset=None, max_in_flight=8):
+        """
+        提交异步写操作，不等待写入完成，需要调用flush()确认写入
+
+        :raises: RadosError
+        """
+        offset = offset if offset is not None else self.offset
+        if self._aio_writer is None:
+            self._aio_writer = self._ho.aio_writer(max_in_flight=max_in_flight)
+
+        self._aio_writer.write(data, offset=offset)
+        wl = len(data)
+        self.offset = offset + wl
+        return wl
+
+    def flush(self):
+        """
+        等待已提交的异步写操作完成
+
+        :raises: RadosError
+        """
+        if self._aio_writer is not None:
+            self._aio_writer.flush()
+
+    def drain(self):
+        """
+        等待已提交的异步写操作完成，忽略写入错误；用于出错后清理数据前，避免删除后仍有写操作写入
+        """
+        try:
+            self.flush()
+        except RadosError:
+            pass
+
     def seek(self, offset):
         size = self.size
         if size <= 0:
@@ -1005,6 +1475,7 @@ class FileWrapper:
             self.offset = size
 
     def delete(self):
+        self.drain()
         self._ho.delete()
 
     def __del__(self):
@@ -1034,10 +1505,9 @@ class ObjectPart(HarborObject):
             None, str        # 不存在
         """
         rados_key = build_part_id(self._obj_id, 0)
-        rados_api = self.get_rados_api()
-        cluster = rados_api.get_cluster()
         try:
-            with cluster.open_ioctx(self._pool_name) as ioctx:
+            rados_api = self.get_rados_api()
+            with rados_api.open_ioctx() as ioctx:
                 try:
                     ok = ioctx.remove_object(rados_key)
                     if ok is True:
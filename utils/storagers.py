@@ -9,6 +9,13 @@ from utils.md5 import FileMD5Handler, Sha256Handler
 from utils.oss.pyrados import build_harbor_object, build_harbor_object_part
 
 
+def get_upload_max_file_size():
+    """
+    上传文件大小上限，settings.CUSTOM_UPLOAD_MAX_FILE_SIZE，默认5GB；None时不限制
+    """
+    return getattr(settings, 'CUSTOM_UPLOAD_MAX_FILE_SIZE', 5 * 2 ** 30)  # default 5GB
+
+
 def try_close_file(f):
     try:
         if hasattr(f, 'close'):
@@ -132,6 +139,7 @@ class FileUploadToCephHandler(FileUploadHandler):
     """
     chunk_size = 5 * 2 ** 20    # 5MB
     max_size_upload_limit = None
+    max_in_flight = 8           # 最多同时进行的异步写rados操作数
 
     def __init__(self, request, using: str, pool_name='', obj_key=''):
         super().__init__(request=request)
@@ -145,7 +153,7 @@ class FileUploadToCephHandler(FileUploadHandler):
         if self.max_size_upload_limit:
             return self.max_size_upload_limit
 
-        return getattr(settings, 'CUSTOM_UPLOAD_MAX_FILE_SIZE', 5 * 2 ** 30)  # default 5GB
+        return get_upload_max_file_size()
 
     def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
         """
@@ -172,11 +180,15 @@ class FileUploadToCephHandler(FileUploadHandler):
         """
         :raises: RadosError
         """
-        self.file.write(raw_data, offset=start)
+        self.file.aio_write(raw_data, offset=start, max_in_flight=self.max_in_flight)
         if self.file_md5_handler:
             self.file_md5_handler.update(offset=start, data=raw_data)
 
     def file_complete(self, file_size):
+        """
+        :raises: RadosError
+        """
+        self.file.flush()       # 等待所有异步写操作完成
         self.file.seek(0)
         self.file.size = file_size
         return CephUploadFile(